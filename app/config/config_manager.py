@@ -13,7 +13,11 @@ class ConfigManager:
             'window_geometry': None,
             'recommended_apis': {},
             'local_apis': {},
-            'api_source': 'recommended'
+            'api_source': 'recommended',
+            'duplicate_mode': 'skip',
+            'preload_batch_size': 5,
+            'metrics_port': 0,
+            'requests_per_host': 0
         }
     
     def load(self):
@@ -1,5 +1,6 @@
 from dataclasses import dataclass, field
-from typing import Optional
+from enum import Enum
+from typing import Optional, List
 
 @dataclass
 class ApiConfig:
@@ -12,6 +13,7 @@ class ApiConfig:
     params: str = ""
     source: str = "unknown"
     line_number: int = 0
+    extractor: str = ""  # apis.txt中声明的图片URL提取规则，如 json:data[*].url 或 re:<正则>
     
     def to_dict(self) -> dict:
         return {
@@ -23,7 +25,8 @@ class ApiConfig:
             "supports_params": self.supports_params,
             "params": self.params,
             "source": self.source,
-            "line_number": self.line_number
+            "line_number": self.line_number,
+            "extractor": self.extractor
         }
     
     @classmethod
@@ -37,5 +40,63 @@ class ApiConfig:
             supports_params=data.get("supports_params", False),
             params=data.get("params", ""),
             source=data.get("source", "unknown"),
-            line_number=data.get("line_number", 0)
+            line_number=data.get("line_number", 0),
+            extractor=data.get("extractor", "")
         )
+
+@dataclass
+class ApiHealth:
+    success_rate: float = 1.0  # 成功率的指数滑动平均
+    ttfb: Optional[float] = None  # 首字节时间（秒）的指数滑动平均
+    throughput: Optional[float] = None  # 下载速度（字节/秒）的指数滑动平均
+    consecutive_failures: int = 0
+    quarantined_until: float = 0.0  # 隔离结束时间（time.monotonic）
+    total_successes: int = 0
+    total_failures: int = 0
+    
+    def to_dict(self) -> dict:
+        return {
+            "success_rate": self.success_rate,
+            "ttfb": self.ttfb,
+            "throughput": self.throughput,
+            "consecutive_failures": self.consecutive_failures,
+            "quarantined_until": self.quarantined_until,
+            "total_successes": self.total_successes,
+            "total_failures": self.total_failures
+        }
+
+class ResolutionKind(Enum):
+    REDIRECT = "redirect"  # 重定向到图片地址
+    JSON = "json"  # 返回包含图片URL的JSON
+    HTML = "html"  # 返回包含图片的网页
+    DIRECT = "direct"  # 直接返回图片内容
+
+@dataclass
+class ResolutionProfile:
+    kind: ResolutionKind
+    expires_at: float  # 过期时间（time.monotonic）
+    hits: int = 0  # 过期前被使用的次数
+    
+    def to_dict(self) -> dict:
+        return {
+            "kind": self.kind.value,
+            "expires_at": self.expires_at,
+            "hits": self.hits
+        }
+
+@dataclass
+class ApiListDiff:
+    added: List[str] = field(default_factory=list)  # 新增的API名称
+    removed: List[str] = field(default_factory=list)  # 被删除的API名称
+    changed: List[str] = field(default_factory=list)  # 地址、权重、说明或参数支持发生变化的API名称
+    
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+    
+    def to_dict(self) -> dict:
+        return {
+            "added": self.added,
+            "removed": self.removed,
+            "changed": self.changed
+        }
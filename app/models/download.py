@@ -17,6 +17,7 @@ class DownloadTask:
     api_name: str = ""
     progress: int = 0
     total_size: int = 0
+    speed: float = 0.0  # 平均下载速度（字节/秒）
     
     def to_dict(self) -> dict:
         return {
@@ -26,7 +27,8 @@ class DownloadTask:
             "error_message": self.error_message,
             "api_name": self.api_name,
             "progress": self.progress,
-            "total_size": self.total_size
+            "total_size": self.total_size,
+            "speed": self.speed
         }
     
     @classmethod
@@ -38,5 +40,50 @@ class DownloadTask:
             error_message=data.get("error_message", ""),
             api_name=data.get("api_name", ""),
             progress=data.get("progress", 0),
-            total_size=data.get("total_size", 0)
+            total_size=data.get("total_size", 0),
+            speed=data.get("speed", 0.0)
         )
+
+@dataclass
+class ProgressInfo:
+    downloaded: int  # 已下载字节数
+    total: int  # 总字节数，未知时为0
+    percent: int
+    speed: float = 0.0  # 字节/秒
+    eta: Optional[float] = None  # 预计剩余秒数，未知时为None
+    elapsed: float = 0.0
+    finished: bool = False
+    
+    def to_dict(self) -> dict:
+        return {
+            "downloaded": self.downloaded,
+            "total": self.total,
+            "percent": self.percent,
+            "speed": self.speed,
+            "eta": self.eta,
+            "elapsed": self.elapsed,
+            "finished": self.finished
+        }
+
+@dataclass
+class PreloadItem:
+    image_url: str
+    api_name: str
+    staged_path: Optional[str] = None  # 已预下载到暂存目录的图片文件
+    size: int = 0
+    content_type: str = ""
+    content_hash: str = ""  # 暂存图片内容的SHA-256，用于去重
+    
+    @property
+    def is_staged(self) -> bool:
+        return bool(self.staged_path)
+    
+    def to_dict(self) -> dict:
+        return {
+            "image_url": self.image_url,
+            "api_name": self.api_name,
+            "staged_path": self.staged_path,
+            "size": self.size,
+            "content_type": self.content_type,
+            "content_hash": self.content_hash
+        }
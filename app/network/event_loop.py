@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import concurrent.futures
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class EventLoopThread:
+    """在独立线程中运行的常驻asyncio事件循环，供同步代码提交协程"""
+    def __init__(self, name: str = "network-event-loop"):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = False
+    
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self.start()
+    
+    def start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("事件循环线程已停止")
+            if self._loop is not None:
+                return self._loop
+            
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+            
+            self._thread = threading.Thread(target=run_loop, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+            logger.info("网络事件循环线程已启动")
+            return loop
+    
+    def in_loop_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+    
+    def submit(self, coro) -> concurrent.futures.Future:
+        """提交协程到事件循环线程，返回concurrent.futures.Future"""
+        try:
+            loop = self.start()
+        except Exception:
+            coro.close()
+            raise
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+    
+    def run(self, coro, timeout=None):
+        """提交协程并阻塞等待结果，不能在事件循环线程内调用"""
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError("不能在事件循环线程内同步等待协程")
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+    
+    def cancel_all(self, timeout: float = 5):
+        """取消事件循环中所有未完成的任务并等待其结束"""
+        loop = self._loop
+        if loop is None or self.in_loop_thread():
+            return
+        
+        async def cancel_pending():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        try:
+            asyncio.run_coroutine_threadsafe(cancel_pending(), loop).result(timeout)
+        except Exception as e:
+            logger.error(f"取消事件循环中的任务失败: {str(e)}")
+    
+    def stop(self, timeout: float = 5):
+        self.cancel_all(timeout)
+        
+        with self._lock:
+            loop = self._loop
+            thread = self._thread
+            self._loop = None
+            self._thread = None
+            self._stopped = True
+        
+        if loop is None:
+            return
+        
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+        logger.info("网络事件循环线程已停止")
+
+# 导出默认事件循环线程
+event_loop = EventLoopThread()
@@ -1,17 +1,64 @@
+import json
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+
 import requests
 import aiohttp
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from app.network.event_loop import event_loop
+from app.network.rate_limiter import RateLimiter
+from app.network.retry import RetryPolicy, RetryStats, AttemptRecord, RETRYABLE_EXCEPTIONS
 from app.utils.logger import get_logger
+from app.utils.metrics import metrics
 
 logger = get_logger(__name__)
 
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36 Edg/144.0.0.0"
+
+class AsyncResponse:
+    """模拟requests.Response对象"""
+    def __init__(self, status_code, content, headers, url):
+        self.status_code = status_code
+        self.content = content
+        self.headers = dict(headers)
+        self.url = url
+    
+    def text(self):
+        return self.content.decode('utf-8')
+    
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
 class HttpClient:
-    def __init__(self, retries=3, backoff_factor=0.3, timeout=10):
+    def __init__(self, retries=3, backoff_factor=0.3, timeout=10,
+                 connection_limit=100, connection_limit_per_host=10,
+                 dns_cache_ttl=300, keepalive_timeout=30,
+                 requests_per_host=0, request_burst=20, bandwidth_limit=0):
         self.session = requests.Session()
         self.timeout = timeout
         
+        # 异步请求统一在网络事件循环线程中执行，同步代码通过run/submit提交协程
+        self.event_loop = event_loop
+        # 异步会话配置：aiohttp会话与事件循环绑定，每个事件循环持有一个长期复用的会话
+        self.connection_limit = connection_limit
+        self.connection_limit_per_host = connection_limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._async_sessions = {}  # 事件循环 -> aiohttp.ClientSession
+        # 图片下载只限制连接和单次读取超时，不限制总时长，避免大图被截断
+        self.download_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+        self._async_lock = threading.Lock()
+        # 异步请求遵守Retry-After，可选按主机限速（每秒请求数）和限制图片下载的总带宽（字节/秒），0为不限制
+        self.rate_limiter = RateLimiter(requests_per_host, request_burst, bandwidth_limit)
+        # 异步请求的重试策略与同步会话的urllib3 Retry使用相同的次数和退避系数
+        self.retry_policy = RetryPolicy(total=retries, backoff_factor=backoff_factor)
+        self.retry_stats = RetryStats()
+        self._attempt_listeners = []
+        
         retry_strategy = Retry(
             total=retries,
             status_forcelist=[429, 500, 502, 503, 504],
@@ -25,7 +72,7 @@ class HttpClient:
         
         # 设置默认User-Agent头
         self.session.headers.update({
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36 Edg/144.0.0.0"
+            "User-Agent": DEFAULT_USER_AGENT
         })
     
     def get(self, url, **kwargs):
@@ -50,38 +97,159 @@ class HttpClient:
             logger.error(f"POST请求失败: {url}, 错误: {str(e)}")
             raise
     
+    def submit(self, coro):
+        """提交协程到网络事件循环线程，返回concurrent.futures.Future"""
+        return self.event_loop.submit(coro)
+    
+    def run(self, coro, timeout=None):
+        """在网络事件循环线程中运行协程并等待结果"""
+        return self.event_loop.run(coro, timeout)
+    
+    def get_async_session(self) -> aiohttp.ClientSession:
+        """获取当前事件循环对应的共享会话，不存在或已关闭时创建"""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            session = self._async_sessions.get(loop)
+            if session is None or session.closed:
+                # 清理已关闭事件循环遗留的会话
+                for stale_loop in [l for l in self._async_sessions if l.is_closed()]:
+                    del self._async_sessions[stale_loop]
+                
+                connector = aiohttp.TCPConnector(
+                    limit=self.connection_limit,
+                    limit_per_host=self.connection_limit_per_host,
+                    ttl_dns_cache=self.dns_cache_ttl,
+                    keepalive_timeout=self.keepalive_timeout
+                )
+                session = aiohttp.ClientSession(
+                    connector=connector,
+                    headers={"User-Agent": DEFAULT_USER_AGENT},
+                    timeout=aiohttp.ClientTimeout(total=self.timeout)
+                )
+                self._async_sessions[loop] = session
+                logger.info("创建异步HTTP会话")
+            return session
+    
     async def async_get(self, url, **kwargs):
         try:
             logger.info(f"发送异步GET请求: {url}")
-            async with aiohttp.ClientSession() as session:
-                session.headers.update({
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36 Edg/144.0.0.0"
-                })
-                async with session.get(url, timeout=self.timeout, **kwargs) as response:
-                    response.raise_for_status()
-                    content = await response.read()
-                    # 模拟requests.Response对象
-                    class AsyncResponse:
-                        def __init__(self, status_code, content, headers, url):
-                            self.status_code = status_code
-                            self.content = content
-                            self.headers = dict(headers)
-                            self.url = url
-                        
-                        def text(self):
-                            return self.content.decode('utf-8')
-                        
-                        def json(self):
-                            import json
-                            return json.loads(self.content.decode('utf-8'))
-                    logger.info(f"异步GET请求成功: {url}, 状态码: {response.status}")
-                    return AsyncResponse(response.status, content, response.headers, str(response.url))
+            async with self.async_stream(url, **kwargs) as response:
+                content = await response.read()
+                logger.info(f"异步GET请求成功: {url}, 状态码: {response.status}")
+                return AsyncResponse(response.status, content, response.headers, str(response.url))
         except Exception as e:
             logger.error(f"异步GET请求失败: {url}, 错误: {str(e)}")
             raise
     
+    @asynccontextmanager
+    async def async_stream(self, url, method="GET", **kwargs):
+        """发送异步请求并返回未读取响应体的响应对象，用于流式读取
+        
+        收到响应头之前的连接错误、超时和可重试的状态码按retry_policy重试；
+        响应体读取过程中的中断由调用方处理（如图片下载的断点续传）
+        """
+        response = await self._request_with_retry(method, url, **kwargs)
+        try:
+            yield response
+        finally:
+            response.release()
+    
+    async def _request_with_retry(self, method, url, **kwargs):
+        policy = self.retry_policy
+        attempt = 0
+        while True:
+            attempt += 1
+            # 限流等待不计入重试，Retry-After过长时抛出RateLimitedError，不再重试
+            wait_started = time.monotonic()
+            await self.rate_limiter.acquire(url)
+            metrics.observe("rate_limit_wait_seconds", time.monotonic() - wait_started, host=self.rate_limiter.host_of(url))
+            record = AttemptRecord(method=method, url=url, attempt=attempt)
+            started = time.monotonic()
+            error = None
+            try:
+                response = await self.get_async_session().request(method, url, **kwargs)
+            except RETRYABLE_EXCEPTIONS as e:
+                error = e
+                record.error = type(e).__name__
+            record.elapsed = time.monotonic() - started
+            
+            if error is None:
+                record.status = response.status
+                if response.status in (429, 503):
+                    self.rate_limiter.apply_retry_after(url, response.headers.get('Retry-After'))
+                if response.status < 400:
+                    self._record_attempt(record)
+                    return response
+            
+            if not policy.should_retry(method, attempt, status=record.status, error=error):
+                self._record_attempt(record)
+                if error is not None:
+                    raise error
+                # raise_for_status会先释放连接再抛出ClientResponseError
+                response.raise_for_status()
+            
+            if error is None:
+                response.release()
+            record.retry_delay = policy.backoff(attempt)
+            self._record_attempt(record)
+            logger.warning(f"请求失败（{record.status or record.error}），{record.retry_delay:.2f} 秒后第 {attempt} 次重试: {url}")
+            await asyncio.sleep(record.retry_delay)
+    
+    def add_attempt_listener(self, callback):
+        """注册请求尝试的回调 callback(AttemptRecord)，用于统计每次尝试的结果"""
+        self._attempt_listeners.append(callback)
+    
+    def _record_attempt(self, record):
+        self.retry_stats.record(record)
+        host = self.rate_limiter.host_of(record.url)
+        outcome = str(record.status) if record.status is not None else record.error
+        metrics.inc("http_attempts_total", host=host, outcome=outcome)
+        metrics.observe("http_attempt_seconds", record.elapsed, host=host)
+        if record.retry_delay is not None:
+            metrics.inc("http_retries_total", host=host)
+        for callback in self._attempt_listeners:
+            try:
+                callback(record)
+            except Exception as e:
+                logger.error(f"请求尝试回调失败: {str(e)}")
+    
+    def get_retry_stats(self) -> dict:
+        return self.retry_stats.get_stats()
+    
+    async def throttle_download(self, size):
+        """下载图片数据时按读取的字节数调用，超过带宽上限时等待"""
+        await self.rate_limiter.acquire_bandwidth(size)
+    
+    async def async_close(self):
+        """关闭当前事件循环对应的异步会话"""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            session = self._async_sessions.pop(loop, None)
+        if session and not session.closed:
+            await session.close()
+    
     def close(self):
         self.session.close()
+        
+        # 先取消仍在运行的异步任务，避免它们在会话关闭后重新创建会话
+        self.event_loop.cancel_all()
+        
+        with self._async_lock:
+            sessions = list(self._async_sessions.items())
+            self._async_sessions.clear()
+        
+        for loop, session in sessions:
+            if session.closed or loop.is_closed():
+                continue
+            try:
+                if loop.is_running():
+                    asyncio.run_coroutine_threadsafe(session.close(), loop).result(timeout=5)
+                else:
+                    loop.run_until_complete(session.close())
+            except Exception as e:
+                logger.error(f"关闭异步HTTP会话失败: {str(e)}")
+        
+        self.event_loop.stop()
 
 # 创建默认HTTP客户端实例
 http_client = HttpClient()
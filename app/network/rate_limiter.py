@@ -0,0 +1,146 @@
+import time
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class RateLimitedError(Exception):
+    """主机要求的等待时间（Retry-After）超过调用方愿意等待的时间"""
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"主机 {host} 限流中，{retry_after:.1f} 秒后才能请求")
+        self.host = host
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """令牌桶：按rate每秒补充令牌，最多积累capacity个
+    
+    允许令牌为负（欠账）：一次取走多于现有的令牌时，调用方等待到欠账还清为止，
+    因此单次可以取任意数量（如一整块下载数据），并发的调用方按先后顺序排队
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def take(self, amount: float) -> float:
+        """取走令牌，返回需要等待的秒数"""
+        self._refill(time.monotonic())
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+    
+    async def acquire(self, amount: float = 1):
+        delay = self.take(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class RateLimiter:
+    """按主机限制请求速率，并可选地限制图片下载的总带宽
+    
+    请求前调用acquire(url)；收到带Retry-After的429/503响应时调用apply_retry_after，
+    之后对该主机的请求会等到限流结束，等待时间超过max_wait时直接抛出RateLimitedError
+    """
+    def __init__(self, requests_per_second: float = 0, burst: int = 20, bandwidth_limit: int = 0,
+                 max_wait: float = 5, max_retry_after: float = 300):
+        self.requests_per_second = requests_per_second  # 每个主机每秒的请求数，0表示不限制
+        self.burst = burst
+        self.max_wait = max_wait
+        self.max_retry_after = max_retry_after  # Retry-After的上限，避免异常的响应头让主机被长期屏蔽
+        self._host_buckets = {}  # 主机 -> TokenBucket
+        self._blocked_until = {}  # 主机 -> Retry-After到期时间（monotonic）
+        self._bandwidth: Optional[TokenBucket] = None
+        self.lock = threading.Lock()
+        self.set_bandwidth_limit(bandwidth_limit)
+    
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlparse(url).netloc.lower()
+    
+    def set_bandwidth_limit(self, bytes_per_second: int):
+        """设置图片下载的总带宽上限（字节/秒），0表示不限制"""
+        with self.lock:
+            if bytes_per_second and bytes_per_second > 0:
+                # 桶容量为1秒的流量，允许短时突发
+                self._bandwidth = TokenBucket(bytes_per_second, bytes_per_second)
+            else:
+                self._bandwidth = None
+    
+    def set_requests_per_host(self, requests_per_second: float):
+        """设置每个主机每秒的请求数，0表示不限制"""
+        with self.lock:
+            self.requests_per_second = max(0.0, requests_per_second or 0)
+            self._host_buckets.clear()
+    
+    def _host_bucket(self, host: str) -> Optional[TokenBucket]:
+        if self.requests_per_second <= 0:
+            return None
+        with self.lock:
+            bucket = self._host_buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.requests_per_second, self.burst)
+                self._host_buckets[host] = bucket
+            return bucket
+    
+    def retry_after_remaining(self, url: str) -> float:
+        host = self.host_of(url)
+        with self.lock:
+            blocked_until = self._blocked_until.get(host, 0)
+        return max(0.0, blocked_until - time.monotonic())
+    
+    async def acquire(self, url: str, max_wait: Optional[float] = None):
+        """等待直到可以向该URL的主机发送请求"""
+        host = self.host_of(url)
+        max_wait = self.max_wait if max_wait is None else max_wait
+        
+        blocked = self.retry_after_remaining(url)
+        if blocked > max_wait:
+            raise RateLimitedError(host, blocked)
+        if blocked > 0:
+            await asyncio.sleep(blocked)
+        
+        bucket = self._host_bucket(host)
+        if bucket is not None:
+            await bucket.acquire()
+    
+    async def acquire_bandwidth(self, size: int):
+        """下载size字节的数据前调用，超过带宽上限时等待"""
+        bandwidth = self._bandwidth
+        if bandwidth is not None and size > 0:
+            await bandwidth.acquire(size)
+    
+    def apply_retry_after(self, url: str, value: Optional[str]) -> Optional[float]:
+        """解析Retry-After响应头（秒数或HTTP日期），在到期前暂停对该主机的请求，返回等待秒数"""
+        delay = self.parse_retry_after(value)
+        if delay is None:
+            return None
+        delay = min(delay, self.max_retry_after)
+        host = self.host_of(url)
+        with self.lock:
+            blocked_until = time.monotonic() + delay
+            self._blocked_until[host] = max(self._blocked_until.get(host, 0), blocked_until)
+        logger.warning(f"主机 {host} 要求 {delay:.1f} 秒后重试")
+        return delay
+    
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        if not value:
+            return None
+        value = value.strip()
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
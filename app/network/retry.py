@@ -0,0 +1,111 @@
+import random
+import asyncio
+import threading
+from collections import deque, Counter
+from dataclasses import dataclass
+from typing import Optional
+
+import aiohttp
+
+# 连接失败、超时等可以安全重试的异常（请求可能没有到达服务器，或幂等请求重复执行无副作用）
+RETRYABLE_EXCEPTIONS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+@dataclass
+class AttemptRecord:
+    method: str
+    url: str
+    attempt: int  # 从1开始
+    status: Optional[int] = None  # 收到响应时的状态码
+    error: str = ""  # 未收到响应时的异常
+    elapsed: float = 0.0  # 本次尝试的耗时（到收到响应头为止）
+    retry_delay: Optional[float] = None  # 将要重试时的等待秒数，不再重试时为None
+    
+    @property
+    def succeeded(self) -> bool:
+        return self.status is not None and self.status < 400
+    
+    def to_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "url": self.url,
+            "attempt": self.attempt,
+            "status": self.status,
+            "error": self.error,
+            "elapsed": self.elapsed,
+            "retry_delay": self.retry_delay
+        }
+
+class RetryPolicy:
+    """异步请求的重试策略，与同步会话使用的urllib3 Retry保持一致的状态码和方法列表
+    
+    退避时间采用“完全抖动”：在 [0, min(max_backoff, backoff_factor * 2^(attempt-1))] 中随机取值，
+    避免大量并发请求在同一时刻重试
+    """
+    def __init__(self, total: int = 3, backoff_factor: float = 0.3, max_backoff: float = 10,
+                 status_forcelist=(429, 500, 502, 503, 504),
+                 allowed_methods=("HEAD", "GET", "PUT", "DELETE", "OPTIONS", "TRACE")):
+        self.total = total  # 最多重试次数（不含第一次请求）
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.status_forcelist = frozenset(status_forcelist)
+        self.allowed_methods = frozenset(method.upper() for method in allowed_methods)
+    
+    def is_idempotent(self, method: str) -> bool:
+        return method.upper() in self.allowed_methods
+    
+    def should_retry(self, method: str, attempt: int, status: Optional[int] = None, error: Optional[BaseException] = None) -> bool:
+        """attempt为刚结束的尝试序号；非幂等的请求（如POST）不重试"""
+        if attempt > self.total or not self.is_idempotent(method):
+            return False
+        if status is not None:
+            return status in self.status_forcelist
+        return isinstance(error, RETRYABLE_EXCEPTIONS)
+    
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** (attempt - 1))))
+
+class RetryStats:
+    """统计每次请求尝试的结果，保留最近的尝试记录"""
+    def __init__(self, history_size: int = 100):
+        self.requests = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0  # 重试用尽或不可重试而失败的请求
+        self.status_counts = Counter()
+        self.error_counts = Counter()
+        self.recent = deque(maxlen=history_size)
+        self.lock = threading.Lock()
+    
+    def record(self, record: AttemptRecord):
+        with self.lock:
+            self.attempts += 1
+            if record.attempt == 1:
+                self.requests += 1
+            if record.retry_delay is not None:
+                self.retries += 1
+            elif not record.succeeded:
+                self.failures += 1
+            if record.status is not None:
+                self.status_counts[record.status] += 1
+            if record.error:
+                self.error_counts[record.error] += 1
+            self.recent.append(record)
+    
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "failures": self.failures,
+                "status_counts": dict(self.status_counts),
+                "error_counts": dict(self.error_counts),
+                "recent": [record.to_dict() for record in self.recent]
+            }
+    
+    def reset(self):
+        with self.lock:
+            self.requests = self.attempts = self.retries = self.failures = 0
+            self.status_counts.clear()
+            self.error_counts.clear()
+            self.recent.clear()
@@ -0,0 +1,185 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+from app.models.api import ApiConfig
+from app.services.extractor_service import extractor_service
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+EXTRACTOR_PREFIXES = ('<json:', '<re:')
+
+class ApiParser:
+    """apis.txt解析器：逐行单遍解析，按内容哈希或文件的mtime/大小缓存解析结果"""
+    def __init__(self, cache_size: int = 8):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # 缓存键 -> 解析出的API列表（只读模板，返回时复制）
+        self._file_keys = {}  # (文件路径, 来源) -> (mtime_ns, 大小, 缓存键)
+        self.lock = threading.Lock()
+    
+    def parse(self, content: str, source: str) -> List[ApiConfig]:
+        """解析API列表文本，内容未变化时直接返回缓存结果"""
+        cache_key = (hashlib.sha1(content.encode('utf-8')).hexdigest(), source)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        apis = self.parse_lines(content.splitlines(), source)
+        self._put_cached(cache_key, apis)
+        return self._copy(apis)
+    
+    def parse_file(self, path: str, source: str) -> List[ApiConfig]:
+        """逐行读取并解析API列表文件，文件的mtime和大小未变化时直接返回缓存结果"""
+        stat = os.stat(path)
+        with self.lock:
+            file_key = self._file_keys.get((path, source))
+        if file_key and file_key[:2] == (stat.st_mtime_ns, stat.st_size):
+            cached = self._get_cached(file_key[2])
+            if cached is not None:
+                return cached
+        
+        with open(path, 'r', encoding='utf-8') as f:
+            apis = self.parse_lines(f, source)
+        cache_key = ('file', path, stat.st_mtime_ns, stat.st_size, source)
+        self._put_cached(cache_key, apis)
+        with self.lock:
+            self._file_keys[(path, source)] = (stat.st_mtime_ns, stat.st_size, cache_key)
+        return self._copy(apis)
+    
+    def parse_lines(self, lines: Iterable[str], source: str) -> List[ApiConfig]:
+        """单遍解析可迭代的文本行（如打开的文件），不使用缓存"""
+        apis = []
+        total_weight = 0
+        actual_line_num = 0
+        
+        for raw_line in lines:
+            # "#"之后为注释
+            hash_pos = raw_line.find('#')
+            line = (raw_line[:hash_pos] if hash_pos >= 0 else raw_line).strip()
+            if not line:
+                continue
+            
+            actual_line_num += 1
+            api_config = self._parse_line(line, source, actual_line_num)
+            if api_config is None:
+                continue
+            
+            apis.append(api_config)
+            if api_config.weight > 0:
+                total_weight += api_config.weight
+        
+        self._normalize_weights(apis, total_weight)
+        return apis
+    
+    def _parse_line(self, line: str, source: str, line_number: int) -> Optional[ApiConfig]:
+        supports_params = False
+        if line[0] == '!':
+            supports_params = True
+            line = line[1:].strip()
+        
+        api_name = None
+        api_url = line
+        
+        colon_pos = line.find(':')
+        if colon_pos >= 0 and colon_pos + 2 < len(line) and line[colon_pos+1:colon_pos+3] != '//':
+            api_name_candidate = line[:colon_pos].strip()
+            if api_name_candidate:
+                api_name = api_name_candidate
+                api_url = line[colon_pos+1:].strip()
+        
+        if api_url.startswith('!'):
+            supports_params = True
+            api_url = api_url[1:].strip()
+        
+        # 提取规则 <json:路径> 或 <re:正则> 写在行末，先取出，避免正则中的 {} | 被当作说明或权重
+        extractor = ""
+        if api_url.endswith('>'):
+            starts = [pos for pos in (api_url.find(prefix) for prefix in EXTRACTOR_PREFIXES) if pos >= 0]
+            if starts:
+                start = min(starts)
+                extractor = api_url[start+1:-1].strip()
+                api_url = api_url[:start].strip()
+                # 解析列表时编译一次，无效的规则在这里给出警告
+                extractor_service.compile(extractor)
+        
+        weight = 1
+        description = ""
+        start_idx = api_url.find('{')
+        if start_idx >= 0:
+            end_idx = api_url.rfind('}')
+            if start_idx < end_idx:
+                description = api_url[start_idx+1:end_idx].strip()
+                api_url = api_url[:start_idx].strip() + api_url[end_idx+1:].strip()
+        
+        if '|' in api_url:
+            parts = api_url.split('|')
+            if len(parts) >= 3:
+                try:
+                    weight = int(parts[1].strip())
+                    api_url = parts[0].strip()
+                except ValueError:
+                    pass
+        
+        if not api_url:
+            return None
+        
+        return ApiConfig(
+            name=api_name or f"{source}_api_{line_number}",
+            url=api_url,
+            weight=weight,
+            description=description,
+            enabled=True,
+            supports_params=supports_params,
+            params="",
+            source=source,
+            line_number=line_number,
+            extractor=extractor
+        )
+    
+    def _normalize_weights(self, apis: List[ApiConfig], total_weight: int):
+        if total_weight > 0:
+            for api in apis:
+                if api.weight > 0:
+                    api.weight = int(api.weight / total_weight * 100)
+        elif apis:
+            non_zero_weight_apis = [api for api in apis if api.weight > 0]
+            if non_zero_weight_apis:
+                weight_per_api = int(100 / len(non_zero_weight_apis))
+                for api in non_zero_weight_apis:
+                    api.weight = weight_per_api
+    
+    def _get_cached(self, cache_key) -> Optional[List[ApiConfig]]:
+        with self.lock:
+            apis = self._cache.get(cache_key)
+            if apis is None:
+                return None
+            self._cache.move_to_end(cache_key)
+        logger.info("API列表未变化，使用缓存的解析结果")
+        return self._copy(apis)
+    
+    def _put_cached(self, cache_key, apis: List[ApiConfig]):
+        with self.lock:
+            self._cache[cache_key] = apis
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+    
+    def _copy(self, apis: List[ApiConfig]) -> List[ApiConfig]:
+        # 调用方会修改启用状态、参数和权重，缓存中的结果必须与返回值相互独立
+        # ApiConfig的字段都是不可变类型，直接复制实例字典即可，比copy.copy快得多
+        copies = []
+        for api in apis:
+            api_copy = object.__new__(ApiConfig)
+            api_copy.__dict__.update(api.__dict__)
+            copies.append(api_copy)
+        return copies
+    
+    def clear_cache(self):
+        with self.lock:
+            self._cache.clear()
+            self._file_keys.clear()
+
+# 导出默认解析器实例
+api_parser = ApiParser()
@@ -1,19 +1,61 @@
 import os
+import json
+import time
+import heapq
+import threading
+import bisect
 import random
-from typing import List, Optional
+from typing import List, Optional, Dict, Tuple, NamedTuple
 
-from app.models.api import ApiConfig
+from app.models.api import ApiConfig, ApiListDiff
 from app.network.http_client import http_client
+from app.services.api_parser import api_parser
+from app.services.extractor_service import extractor_service
+from app.services.resolution_service import resolution_service
+from app.services.health_service import health_service
 from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+class SelectionTable(NamedTuple):
+    apis: List[ApiConfig]  # 可用且权重大于0的API
+    weights: List[float]  # 实际权重（静态权重 x 健康系数）
+    cum_weights: List[float]
+    total_weight: float
+    fallback_apis: List[ApiConfig]  # 没有权重大于0的API时平均选择的API
+    health_version: int
+    score_version: int
+    expires_at: float  # 最早的隔离到期时间，到期后需要重建
+    built_at: float
+
 class ApiService:
-    def __init__(self, api_file: str = "apis.txt", recommended_api_url: str = "https://gitee.com/yxxawa/gg/raw/master/apis.txt"):
+    def __init__(self, api_file: str = "apis.txt", recommended_api_url: str = "https://gitee.com/yxxawa/gg/raw/master/apis.txt",
+                 cache_dir: str = "cache"):
         self.api_file = api_file
         self.recommended_api_url = recommended_api_url
         self.apis: List[ApiConfig] = []
+        self.source: Optional[str] = None  # 当前加载的API来源
         self.recommended_api_cache: Optional[str] = None
+        # 推荐API列表的磁盘缓存及其ETag/Last-Modified，启动时先使用缓存，再在后台条件请求重新验证
+        self.recommended_cache_file = os.path.join(cache_dir, "recommended_apis.txt")
+        self.recommended_meta_file = os.path.join(cache_dir, "recommended_apis.json")
+        self.recommended_meta: Dict[str, str] = {}
+        self._revalidate_started = False
+        self._revalidate_pending = False  # 使用了推荐API磁盘缓存，加载完成后需要在后台重新验证
+        self._change_listeners = []
+        # 本地API文件监视：轮询mtime/大小，变化时增量更新
+        self.watch_interval = 1.0
+        self._watch_thread: Optional[threading.Thread] = None
+        self._watch_stop = threading.Event()
+        self._local_file_state: Optional[Tuple[int, int]] = None
+        self._local_parsed: Dict[Tuple[str, int], ApiConfig] = {}  # 上次解析结果，用于比较文件内容的变化
+        self._reload_lock = threading.Lock()
+        # 预计算的选择表，整体替换而不是原地修改，读取方无需加锁
+        self._selection_table = SelectionTable([], [], [], 0.0, [], -1, -1, float('inf'), 0.0)
+        self.score_refresh_interval = 1.0  # 健康系数变化引起的重建最多每隔多少秒一次
+        # 名称索引，与self.apis保持同步，同样整体替换
+        self._name_index: Dict[str, ApiConfig] = {}
+        self._key_index: Dict[Tuple[str, str], int] = {}  # (名称, 来源) -> 在self.apis中的位置
     
     def load_apis(self, source: str = "recommended") -> List[ApiConfig]:
         try:
@@ -22,24 +64,135 @@ class ApiService:
             else:
                 apis = self._load_local_apis()
             
-            self.apis = apis
+            self._set_apis(apis, source)
             logger.info(f"API加载成功，共加载 {len(apis)} 个API")
+            # 重新验证线程要在API列表和来源设置好之后启动，否则其结果可能被当作其他来源而丢弃或被覆盖
+            if source == "recommended" and self._revalidate_pending:
+                self._start_recommended_revalidation()
             return apis
         except Exception as e:
             logger.error(f"API加载失败: {str(e)}")
             return []
     
+    def _set_apis(self, apis: List[ApiConfig], source: str):
+        self.apis = apis
+        self.source = source
+        # 同名API在新列表中可能是不同的地址，自动识别的提取规则和响应方式需要重新识别
+        extractor_service.forget()
+        resolution_service.forget()
+        self._rebuild_index()
+        self._rebuild_selection_table()
+    
+    def add_change_listener(self, callback):
+        """注册API列表在后台变化时的回调，在后台线程中调用 callback(source, diff)
+        
+        diff为ApiListDiff时只有其中列出的API发生了变化；为None时整个API列表已被替换
+        """
+        self._change_listeners.append(callback)
+    
+    def _notify_change(self, source: str, diff: Optional[ApiListDiff] = None):
+        for callback in list(self._change_listeners):
+            try:
+                callback(source, diff)
+            except Exception as e:
+                logger.error(f"API变化回调失败: {str(e)}")
+    
     def _load_recommended_apis(self) -> List[ApiConfig]:
         try:
             if not self.recommended_api_cache:
-                response = http_client.get(self.recommended_api_url)
-                self.recommended_api_cache = response.text
+                if self._read_recommended_disk_cache():
+                    # 先使用磁盘缓存，避免启动时阻塞在网络请求上，由load_apis随后在后台重新验证
+                    self._revalidate_pending = True
+                else:
+                    response = http_client.get(self.recommended_api_url)
+                    self.recommended_api_cache = response.text
+                    self._write_recommended_disk_cache(response.text, response.headers)
             
             return self._parse_api_content(self.recommended_api_cache, "recommended")
         except Exception as e:
             logger.error(f"推荐API加载失败: {str(e)}")
             return []
     
+    def _read_recommended_disk_cache(self) -> bool:
+        try:
+            if not os.path.exists(self.recommended_cache_file):
+                return False
+            with open(self.recommended_cache_file, 'r', encoding='utf-8') as f:
+                content = f.read()
+            meta = {}
+            if os.path.exists(self.recommended_meta_file):
+                with open(self.recommended_meta_file, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            # 推荐API地址变化后，旧缓存不再有效
+            if meta.get('url', self.recommended_api_url) != self.recommended_api_url:
+                return False
+            self.recommended_api_cache = content
+            self.recommended_meta = meta
+            logger.info(f"使用推荐API磁盘缓存: {self.recommended_cache_file}")
+            return True
+        except Exception as e:
+            logger.error(f"读取推荐API磁盘缓存失败: {str(e)}")
+            return False
+    
+    def _write_recommended_disk_cache(self, content: str, headers):
+        try:
+            cache_dir = os.path.dirname(self.recommended_cache_file)
+            if cache_dir and not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            
+            meta = {'url': self.recommended_api_url}
+            if headers.get('ETag'):
+                meta['etag'] = headers['ETag']
+            if headers.get('Last-Modified'):
+                meta['last_modified'] = headers['Last-Modified']
+            
+            for path, data in ((self.recommended_cache_file, content),
+                               (self.recommended_meta_file, json.dumps(meta, ensure_ascii=False))):
+                temp_file = f"{path}.tmp"
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(temp_file, path)
+            self.recommended_meta = meta
+        except Exception as e:
+            logger.error(f"保存推荐API磁盘缓存失败: {str(e)}")
+    
+    def _start_recommended_revalidation(self):
+        self._revalidate_pending = False
+        if self._revalidate_started:
+            return
+        self._revalidate_started = True
+        revalidate_thread = threading.Thread(target=self._revalidate_recommended_apis)
+        revalidate_thread.daemon = True
+        revalidate_thread.start()
+    
+    def _revalidate_recommended_apis(self):
+        """使用条件请求重新验证推荐API列表，内容变化时更新缓存并替换已加载的API"""
+        try:
+            headers = {}
+            if self.recommended_meta.get('etag'):
+                headers['If-None-Match'] = self.recommended_meta['etag']
+            if self.recommended_meta.get('last_modified'):
+                headers['If-Modified-Since'] = self.recommended_meta['last_modified']
+            
+            response = http_client.get(self.recommended_api_url, headers=headers)
+            if response.status_code == 304:
+                logger.info("推荐API列表未变化")
+                return
+            
+            content = response.text
+            self._write_recommended_disk_cache(content, response.headers)
+            if content == self.recommended_api_cache:
+                logger.info("推荐API列表内容未变化")
+                return
+            
+            self.recommended_api_cache = content
+            logger.info("推荐API列表已更新")
+            if self.source == "recommended":
+                self._set_apis(self._parse_api_content(content, "recommended"), "recommended")
+                self._notify_change("recommended")
+        except Exception as e:
+            logger.error(f"重新验证推荐API列表失败: {str(e)}")
+    
     def _load_local_apis(self) -> List[ApiConfig]:
         try:
             if not os.path.exists(self.api_file):
@@ -47,124 +200,231 @@ class ApiService:
                     f.write('')
                 return []
             
-            with open(self.api_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            return self._parse_api_content(content, "local")
+            stat = os.stat(self.api_file)
+            apis = api_parser.parse_file(self.api_file, "local")
+            self._local_file_state = (stat.st_mtime_ns, stat.st_size)
+            self._local_parsed = self._snapshot(apis)
+            return apis
         except Exception as e:
             logger.error(f"本地API加载失败: {str(e)}")
             return []
     
-    def _parse_api_content(self, content: str, source: str) -> List[ApiConfig]:
-        apis = []
-        total_weight = 0
-        actual_line_num = 0
+    def _snapshot(self, apis: List[ApiConfig]) -> Dict[Tuple[str, int], ApiConfig]:
+        """按 (名称, 行号) 记录解析结果的副本，名称按与索引相同的规则去重"""
+        snapshot_apis = [ApiConfig.from_dict(api.to_dict()) for api in apis]
+        self._disambiguate_names(snapshot_apis, warn=False)
+        return {(api.name, api.line_number): api for api in snapshot_apis}
+    
+    def start_watching(self, interval: Optional[float] = None):
+        """启动后台线程轮询本地API文件，文件变化且当前来源为本地时增量更新API列表"""
+        if interval is not None:
+            self.watch_interval = interval
+        if self._watch_thread and self._watch_thread.is_alive():
+            return
+        self._watch_stop.clear()
+        self._watch_thread = threading.Thread(target=self._watch_local_file)
+        self._watch_thread.daemon = True
+        self._watch_thread.start()
+        logger.info(f"开始监视本地API文件: {self.api_file}")
+    
+    def stop_watching(self):
+        self._watch_stop.set()
+    
+    def _watch_local_file(self):
+        while not self._watch_stop.wait(self.watch_interval):
+            try:
+                if self.source != "local" or not os.path.exists(self.api_file):
+                    continue
+                stat = os.stat(self.api_file)
+                if (stat.st_mtime_ns, stat.st_size) != self._local_file_state:
+                    self.reload_local_apis()
+            except Exception as e:
+                logger.error(f"监视本地API文件失败: {str(e)}")
+    
+    def reload_local_apis(self) -> Optional[ApiListDiff]:
+        """重新解析本地API文件并按 (名称, 行号) 增量更新，未变化的API保持原对象（含启用状态和参数）
         
-        for line_num, line in enumerate(content.split('\n'), 1):
-            line = line.strip()
+        显式命名的API行号变化时（如在前面插入了一行）按名称对应，仍视为同一个API
+        """
+        with self._reload_lock:
+            if self.source != "local":
+                return None
             
-            if not line:
-                continue
+            stat = os.stat(self.api_file)
+            new_apis = api_parser.parse_file(self.api_file, "local")
+            self._disambiguate_names(new_apis)
+            new_parsed = self._snapshot(new_apis)
+            old_parsed = self._local_parsed
+            current = {(api.name, api.line_number): api for api in self.apis}
+            matches = self._match_reloaded_apis(new_apis, current)
             
-            if '#' in line:
-                line = line.split('#', 1)[0].strip()
-                if not line:
+            diff = ApiListDiff()
+            reweighted = False
+            for new_api in new_apis:
+                key = matches.get((new_api.name, new_api.line_number))
+                if key is None:
+                    diff.added.append(new_api.name)
                     continue
+                old_api = old_parsed.get(key)
+                if old_api is None or (old_api.url, old_api.description, old_api.supports_params, old_api.extractor) != \
+                        (new_api.url, new_api.description, new_api.supports_params, new_api.extractor):
+                    diff.changed.append(new_api.name)
+                elif old_api.weight != new_api.weight:
+                    # 只有权重变化（包括其他行增删导致的重新归一化）不影响已预加载的图片，不计入changed
+                    reweighted = True
+            matched_keys = set(matches.values())
+            diff.removed = [api.name for key, api in current.items() if key not in matched_keys]
             
-            actual_line_num += 1
-            
-            supports_params = False
-            if line.startswith('!'):
-                supports_params = True
-                line = line[1:].strip()
-            
-            api_name = None
-            api_url = line
-            
-            if ':' in line:
-                colon_pos = line.find(':')
-                if colon_pos + 2 < len(line) and line[colon_pos+1:colon_pos+3] != '//':
-                    api_name_candidate = line[:colon_pos].strip()
-                    if api_name_candidate:
-                        api_name = api_name_candidate
-                        api_url = line[colon_pos+1:].strip()
-            
-            if api_url.startswith('!'):
-                supports_params = True
-                api_url = api_url[1:].strip()
-            
-            weight = 1
-            description = ""
-            if '{' in api_url and '}' in api_url:
-                start_idx = api_url.find('{')
-                end_idx = api_url.rfind('}')
-                if start_idx < end_idx:
-                    description = api_url[start_idx+1:end_idx].strip()
-                    api_url = api_url[:start_idx].strip() + api_url[end_idx+1:].strip()
-            
-            if '|' in api_url:
-                parts = api_url.split('|')
-                if len(parts) >= 3:
-                    try:
-                        weight = int(parts[1].strip())
-                        api_url = parts[0].strip()
-                    except ValueError:
-                        pass
-            
-            if not api_url:
-                continue
+            self._local_file_state = (stat.st_mtime_ns, stat.st_size)
+            self._local_parsed = new_parsed
+            if diff.is_empty and not reweighted:
+                logger.info("本地API文件已保存，内容未变化")
+                return diff
             
-            if not api_name:
-                api_name = f"{source}_api_{actual_line_num}"
-            
-            api_config = ApiConfig(
-                name=api_name,
-                url=api_url,
-                weight=weight,
-                description=description,
-                enabled=True,
-                supports_params=supports_params,
-                params="",
-                source=source,
-                line_number=actual_line_num
-            )
-            
-            apis.append(api_config)
-            if weight > 0:
-                total_weight += weight
+            merged = []
+            for new_api in new_apis:
+                key = matches.get((new_api.name, new_api.line_number))
+                if key is None:
+                    merged.append(new_api)
+                    continue
+                live_api = current[key]
+                # 更新文件中定义的字段，保留启用状态和参数；权重随文件整体重新归一化
+                live_api.line_number = new_api.line_number
+                live_api.url = new_api.url
+                live_api.weight = new_api.weight if live_api.enabled else 0
+                live_api.description = new_api.description
+                live_api.supports_params = new_api.supports_params
+                live_api.extractor = new_api.extractor
+                merged.append(live_api)
+            
+            self.apis = merged
+            for name in diff.removed + diff.changed:
+                extractor_service.forget(name)
+                resolution_service.forget(name)
+            self._rebuild_index()
+            self.recalculate_weights()
+            logger.info(f"本地API文件已更新: 新增 {len(diff.added)} 个，删除 {len(diff.removed)} 个，修改 {len(diff.changed)} 个")
+        
+        self._notify_change("local", diff)
+        return diff
+    
+    def _match_reloaded_apis(self, new_apis: List[ApiConfig],
+                             current: Dict[Tuple[str, int], ApiConfig]) -> Dict[Tuple[str, int], Tuple[str, int]]:
+        """把重新解析的API对应到当前的API，返回 新的(名称, 行号) -> 当前的(名称, 行号)
+        
+        先按 (名称, 行号) 精确对应；剩下的API中，在文件中显式命名的按名称对应。
+        自动生成的名称和重名后的名称本身包含行号，行号变化时无法对应，视为删除后新增
+        """
+        matches = {}
+        unmatched = []
+        for new_api in new_apis:
+            key = (new_api.name, new_api.line_number)
+            if key in current:
+                matches[key] = key
+            else:
+                unmatched.append(new_api)
+        
+        matched_keys = set(matches.values())
+        # 当前列表中的名称已经过_disambiguate_names处理，不会重复
+        by_name = {key[0]: key for key in current if key not in matched_keys}
+        for new_api in unmatched:
+            if '#' in new_api.name or new_api.name == f"{new_api.source}_api_{new_api.line_number}":
+                continue
+            key = by_name.pop(new_api.name, None)
+            if key is not None:
+                matches[(new_api.name, new_api.line_number)] = key
+        return matches
+    
+    def _parse_api_content(self, content: str, source: str) -> List[ApiConfig]:
+        return api_parser.parse(content, source)
+    
+    def _disambiguate_names(self, apis: List[ApiConfig], warn: bool = True):
+        """重名的API只保留第一个的名称，其余重命名为 名称#行号"""
+        names = set()
+        for api in apis:
+            if api.name in names:
+                # 解析出的名称不会包含"#"（"#"之后为注释），因此重命名后不会与文件中的其他名称冲突
+                new_name = f"{api.name}#{api.line_number}"
+                suffix = 2
+                while new_name in names:
+                    new_name = f"{api.name}#{api.line_number}_{suffix}"
+                    suffix += 1
+                if warn:
+                    logger.warning(f"API名称重复: {api.name}（第{api.line_number}个API），重命名为 {new_name}")
+                api.name = new_name
+            names.add(api.name)
+    
+    def _rebuild_index(self):
+        """重建名称索引，重名的API先按_disambiguate_names重命名"""
+        self._disambiguate_names(self.apis)
+        name_index = {}
+        key_index = {}
+        for i, api in enumerate(self.apis):
+            name_index[api.name] = api
+            key_index[(api.name, api.source)] = i
+        self._name_index = name_index
+        self._key_index = key_index
+    
+    def _rebuild_selection_table(self):
+        """重建累计权重表，在API列表、启用状态、权重或健康状态变化后调用
         
-        if total_weight > 0:
-            for api in apis:
-                if api.weight > 0:
-                    api.weight = int(api.weight / total_weight * 100)
-        elif apis:
-            non_zero_weight_apis = [api for api in apis if api.weight > 0]
-            if non_zero_weight_apis:
-                weight_per_api = int(100 / len(non_zero_weight_apis))
-                for api in non_zero_weight_apis:
-                    api.weight = weight_per_api
+        实际权重为静态权重乘以健康系数，隔离中的API不参与选择
+        """
+        now = time.monotonic()
+        health_version = health_service.version
+        score_version = health_service.score_version
+        weighted_apis = []
+        weights = []
+        cum_weights = []
+        total_weight = 0.0
+        enabled_apis = []
+        available_apis = []
+        expires_at = float('inf')
+        for api in self.apis:
+            if not api.enabled:
+                continue
+            enabled_apis.append(api)
+            if health_service.is_quarantined(api.name, now):
+                expires_at = min(expires_at, health_service.quarantine_expiry(api.name))
+                continue
+            available_apis.append(api)
+            if api.weight > 0:
+                weight = api.weight * health_service.score(api.name)
+                total_weight += weight
+                weighted_apis.append(api)
+                weights.append(weight)
+                cum_weights.append(total_weight)
         
-        return apis
+        # 所有启用的API都在隔离中时，仍然在其中平均选择，而不是无API可用
+        fallback_apis = available_apis or enabled_apis
+        if total_weight == 0 and fallback_apis and (self._selection_table.total_weight > 0 or not self._selection_table.fallback_apis):
+            logger.warning("没有可用且权重大于0的API，将在启用的API中平均选择")
+        self._selection_table = SelectionTable(weighted_apis, weights, cum_weights, total_weight,
+                                               fallback_apis, health_version, score_version, expires_at, now)
+    
+    def _get_selection_table(self) -> "SelectionTable":
+        """返回当前选择表；API进入或解除隔离、隔离到期时先重建，健康系数明显变化时限制频率重建"""
+        table = self._selection_table
+        now = time.monotonic()
+        if (table.health_version != health_service.version or now >= table.expires_at
+                or (table.score_version != health_service.score_version
+                    and now - table.built_at >= self.score_refresh_interval)):
+            self._rebuild_selection_table()
+            table = self._selection_table
+        return table
     
     def get_random_api(self) -> Optional[ApiConfig]:
         try:
-            # 首先尝试获取启用且权重大于0的API
-            enabled_apis = [api for api in self.apis if api.enabled and api.weight > 0]
-            if enabled_apis:
-                weighted_apis = []
-                for api in enabled_apis:
-                    weighted_apis.extend([api] * api.weight)
-                
-                if weighted_apis:
-                    return random.choice(weighted_apis)
-                else:
-                    return random.choice(enabled_apis)
+            table = self._get_selection_table()
             
-            # 如果没有启用且权重大于0的API，尝试获取任何启用的API
-            enabled_any_weight = [api for api in self.apis if api.enabled]
-            if enabled_any_weight:
-                logger.warning("没有启用且权重大于0的API，使用任意启用的API")
-                return random.choice(enabled_any_weight)
+            # 首先按实际权重在可用且权重大于0的API中二分查找
+            if table.total_weight > 0:
+                index = bisect.bisect_right(table.cum_weights, random.random() * table.total_weight)
+                return table.apis[min(index, len(table.apis) - 1)]
+            
+            # 如果没有可用且权重大于0的API，尝试获取任何启用的API
+            if table.fallback_apis:
+                return random.choice(table.fallback_apis)
             
             logger.warning("没有启用的API")
             return None
@@ -172,15 +432,40 @@ class ApiService:
             logger.error(f"随机获取API失败: {str(e)}")
             return None
     
+    def sample(self, k: int, unique: bool = True) -> List[ApiConfig]:
+        """按权重随机选择k个API，unique为True时不重复（可用API不足时返回的数量少于k）"""
+        try:
+            if k <= 0:
+                return []
+            if not unique:
+                return [api for api in (self.get_random_api() for _ in range(k)) if api]
+            
+            table = self._get_selection_table()
+            if table.total_weight > 0:
+                # 加权无放回抽样（Efraimidis-Spirakis）：取 random()^(1/weight) 最大的k个
+                keyed = ((random.random() ** (1.0 / weight), i) for i, weight in enumerate(table.weights))
+                return [table.apis[i] for _, i in heapq.nlargest(k, keyed)]
+            
+            return random.sample(table.fallback_apis, min(k, len(table.fallback_apis)))
+        except Exception as e:
+            logger.error(f"随机选择API失败: {str(e)}")
+            return []
+    
     def update_api(self, api_config: ApiConfig) -> bool:
         try:
-            for i, api in enumerate(self.apis):
-                if api.name == api_config.name and api.source == api_config.source:
-                    self.apis[i] = api_config
-                    logger.info(f"API更新成功: {api_config.name}")
-                    return True
+            index = self._key_index.get((api_config.name, api_config.source))
+            if index is not None:
+                self.apis[index] = api_config
+                name_index = dict(self._name_index)
+                name_index[api_config.name] = api_config
+                self._name_index = name_index
+                self._rebuild_selection_table()
+                logger.info(f"API更新成功: {api_config.name}")
+                return True
             
             self.apis.append(api_config)
+            self._rebuild_index()
+            self._rebuild_selection_table()
             logger.info(f"API添加成功: {api_config.name}")
             return True
         except Exception as e:
@@ -191,10 +476,11 @@ class ApiService:
         return self.apis
     
     def get_api_by_name(self, name: str) -> Optional[ApiConfig]:
-        for api in self.apis:
-            if api.name == name:
-                return api
-        return None
+        return self._name_index.get(name)
+    
+    def get_api(self, name: str, source: str) -> Optional[ApiConfig]:
+        index = self._key_index.get((name, source))
+        return self.apis[index] if index is not None else None
     
     def recalculate_weights(self) -> List[ApiConfig]:
         """重新计算API权重"""
@@ -202,6 +488,7 @@ class ApiService:
             enabled_apis = [api for api in self.apis if api.enabled]
             if not enabled_apis:
                 logger.warning("没有启用的API")
+                self._rebuild_selection_table()
                 return self.apis
             
             # 计算总权重
@@ -224,6 +511,7 @@ class ApiService:
                     else:
                         api.weight = 0
             
+            self._rebuild_selection_table()
             logger.info("API权重重新计算完成")
             return self.apis
         except Exception as e:
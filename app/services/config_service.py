@@ -6,6 +6,9 @@ from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# 下载到重复图片时的处理方式：skip 跳过并使用已有文件，hardlink 创建指向已有文件的硬链接，keep 照常保存
+DUPLICATE_MODES = ('skip', 'hardlink', 'keep')
+
 class ConfigService:
     def __init__(self):
         self.config = config_manager.load()
@@ -30,6 +33,41 @@ class ConfigService:
         self.config['api_source'] = source
         return self.save()
     
+    def get_duplicate_mode(self) -> str:
+        mode = self.config.get('duplicate_mode', 'skip')
+        return mode if mode in DUPLICATE_MODES else 'skip'
+    
+    def set_duplicate_mode(self, mode: str) -> bool:
+        if mode not in DUPLICATE_MODES:
+            logger.error(f"无效的重复图片处理方式: {mode}")
+            return False
+        self.config['duplicate_mode'] = mode
+        return self.save()
+    
+    def get_preload_batch_size(self) -> int:
+        try:
+            return max(1, int(self.config.get('preload_batch_size', 5)))
+        except (TypeError, ValueError):
+            return 5
+    
+    def set_preload_batch_size(self, size: int) -> bool:
+        self.config['preload_batch_size'] = max(1, int(size))
+        return self.save()
+    
+    def get_metrics_port(self) -> int:
+        """本地指标服务的端口，0表示不启动"""
+        try:
+            return max(0, int(self.config.get('metrics_port', 0)))
+        except (TypeError, ValueError):
+            return 0
+    
+    def get_requests_per_host(self) -> float:
+        """异步请求按主机限速的每秒请求数，0表示不限制"""
+        try:
+            return max(0.0, float(self.config.get('requests_per_host', 0)))
+        except (TypeError, ValueError):
+            return 0.0
+    
     def get_window_geometry(self) -> Optional[bytes]:
         window_geometry = self.config.get('window_geometry')
         if isinstance(window_geometry, str):
@@ -44,13 +82,17 @@ class ConfigService:
         self.config['window_geometry'] = geometry
         return self.save()
     
+    @staticmethod
+    def _api_config_key(api: ApiConfig) -> str:
+        """保存配置时使用的键：重名而被重命名为 名称#行号 的API仍使用文件中解析出的名称，与重命名之前保存的键一致"""
+        return f"{api.name.split('#', 1)[0]}_{api.line_number}"
+    
     def save_api_configs(self, api_configs: List[ApiConfig]) -> bool:
         source = self.get_api_source()
         api_dict = {}
         
         for api in api_configs:
-            config_key = f"{api.name}_{api.line_number}"
-            api_dict[config_key] = {
+            api_dict[self._api_config_key(api)] = {
                 'weight': api.weight,
                 'params': api.params,
                 'enabled': api.enabled,
@@ -70,9 +112,9 @@ class ConfigService:
         saved_configs = self.config.get(config_key, {})
         
         for api in api_configs:
-            current_key = f"{api.name}_{api.line_number}"
-            if current_key in saved_configs:
-                saved_config = saved_configs[current_key]
+            # 兼容按重命名后的名称保存的键
+            saved_config = saved_configs.get(self._api_config_key(api)) or saved_configs.get(f"{api.name}_{api.line_number}")
+            if saved_config:
                 # 只加载启用状态和参数，不加载权重，权重应该从文件中读取
                 api.params = saved_config.get('params', api.params)
                 api.enabled = saved_config.get('enabled', api.enabled)
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Optional
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_FILE_NAME = '.image_index.json'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+class DedupService:
+    """下载目录的内容哈希索引：记录 文件 -> 内容哈希 和 图片URL -> 内容哈希，用于跳过重复图片"""
+    def __init__(self, save_interval: float = 5):
+        self.download_dir = None
+        self.index_file = None
+        self.save_interval = save_interval  # 索引变化后最多间隔多少秒写回磁盘
+        self.files = {}  # 文件名（相对下载目录） -> 内容哈希
+        self.hashes = {}  # 内容哈希 -> 文件名，由files推导
+        self.urls = {}  # 图片URL -> 内容哈希
+        self.lock = threading.RLock()
+        self._save_lock = threading.Lock()  # 串行化写回，写磁盘时不持有self.lock
+        self._save_timer: Optional[threading.Timer] = None
+        self._dirty = False
+        self._last_saved = 0.0
+        self._generation = 0  # 每次切换目录时递增，使过期的扫描线程放弃写入
+    
+    @staticmethod
+    def new_hasher():
+        return hashlib.sha256()
+    
+    def load(self, download_dir: str):
+        """加载下载目录的索引，清理已删除文件的记录，并在后台为未索引的图片计算哈希"""
+        self.flush()
+        with self.lock:
+            self._generation += 1
+            generation = self._generation
+            self.download_dir = download_dir
+            self.index_file = os.path.join(download_dir, INDEX_FILE_NAME)
+            self.files = {}
+            self.urls = {}
+            self._dirty = False
+            
+            try:
+                if os.path.exists(self.index_file):
+                    with open(self.index_file, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    self.files = {name: digest for name, digest in data.get('files', {}).items()
+                                  if os.path.isfile(os.path.join(download_dir, name))}
+                    known_hashes = set(self.files.values())
+                    self.urls = {url: digest for url, digest in data.get('urls', {}).items() if digest in known_hashes}
+                    self._dirty = len(self.files) != len(data.get('files', {}))
+            except Exception as e:
+                logger.error(f"加载图片索引失败，将重新建立索引: {str(e)}")
+                self.files = {}
+                self.urls = {}
+            self._rebuild_hashes()
+            logger.info(f"已加载图片索引: {len(self.files)} 个文件，{len(self.urls)} 个URL")
+        
+        scanner = threading.Thread(target=self._scan_unindexed, args=(generation, time.time()))
+        scanner.daemon = True
+        scanner.start()
+    
+    def _rebuild_hashes(self):
+        self.hashes = {}
+        for name, digest in self.files.items():
+            self.hashes.setdefault(digest, name)
+    
+    def _scan_unindexed(self, generation: int, started: float):
+        """为下载目录中未索引的图片计算哈希，跳过扫描开始后才修改的文件（可能仍在写入）"""
+        try:
+            with self.lock:
+                download_dir = self.download_dir
+                indexed = set(self.files)
+            names = [entry.name for entry in os.scandir(download_dir)
+                     if entry.is_file() and not entry.name.startswith('.')
+                     and entry.name not in indexed and entry.stat().st_mtime < started]
+            if not names:
+                return
+            
+            logger.info(f"开始为 {len(names)} 个未索引的图片计算哈希")
+            for name in names:
+                digest = self.hash_file(os.path.join(download_dir, name))
+                with self.lock:
+                    if generation != self._generation:
+                        return
+                    if digest and name not in self.files:
+                        self._add_file(name, digest)
+            if generation == self._generation:
+                self.flush()
+            logger.info("未索引图片的哈希计算完成")
+        except Exception as e:
+            logger.error(f"扫描下载目录失败: {str(e)}")
+    
+    def hash_file(self, path: str) -> Optional[str]:
+        hasher = self.new_hasher()
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+        except OSError as e:
+            logger.error(f"计算文件哈希失败: {str(e)}")
+            return None
+        return hasher.hexdigest()
+    
+    def _add_file(self, name: str, digest: str):
+        self.files[name] = digest
+        self.hashes.setdefault(digest, name)
+        self._dirty = True
+    
+    def _existing_path(self, digest: str) -> Optional[str]:
+        """返回内容哈希对应的已存在文件路径，文件已被删除时清理记录"""
+        name = self.hashes.get(digest)
+        while name is not None:
+            path = os.path.join(self.download_dir, name)
+            if os.path.isfile(path):
+                return path
+            # 文件已被用户删除，改用同内容的其他文件
+            del self.files[name]
+            self._dirty = True
+            self._rebuild_hashes()
+            name = self.hashes.get(digest)
+        return None
+    
+    def find_by_hash(self, digest: str) -> Optional[str]:
+        with self.lock:
+            if self.download_dir is None:
+                return None
+            return self._existing_path(digest)
+    
+    def find_by_url(self, url: str) -> Optional[str]:
+        """返回该图片URL之前下载到的文件路径，未下载过或文件已被删除时返回None"""
+        with self.lock:
+            digest = self.urls.get(url)
+            if digest is None or self.download_dir is None:
+                return None
+            return self._existing_path(digest)
+    
+    def claim(self, digest: str, path: str, url: Optional[str] = None) -> Optional[str]:
+        """登记新下载的文件；内容已存在时不登记文件并返回已有文件的路径"""
+        with self.lock:
+            if self.download_dir is None:
+                return None
+            if url:
+                self.urls[url] = digest
+                self._dirty = True
+            existing_path = self._existing_path(digest)
+            if existing_path is None or os.path.abspath(existing_path) == os.path.abspath(path):
+                self._add_file(os.path.relpath(path, self.download_dir), digest)
+                existing_path = None
+            self._save_if_due()
+            return existing_path
+    
+    def add(self, digest: str, path: str, url: Optional[str] = None):
+        """登记文件（包括重复图片的硬链接或保留的副本）"""
+        with self.lock:
+            if self.download_dir is None:
+                return
+            self._add_file(os.path.relpath(path, self.download_dir), digest)
+            if url:
+                self.urls[url] = digest
+            self._save_if_due()
+    
+    def _save_if_due(self):
+        """安排在后台线程中写回索引，距上次写回不足save_interval时推迟到期满
+        
+        claim()和add()在事件循环中调用，不能在调用方线程中写磁盘
+        """
+        if not self._dirty or self._save_timer is not None:
+            return
+        delay = max(0.0, self.save_interval - (time.monotonic() - self._last_saved))
+        self._save_timer = threading.Timer(delay, self._deferred_flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+    
+    def _deferred_flush(self):
+        with self.lock:
+            self._save_timer = None
+        self.flush()
+    
+    def flush(self):
+        """将索引原子地写回磁盘，只在复制索引时持有self.lock"""
+        with self._save_lock:
+            with self.lock:
+                if not self._dirty or self.index_file is None:
+                    return
+                index_file = self.index_file
+                data = {'files': dict(self.files), 'urls': dict(self.urls)}
+                self._dirty = False
+            temp_file = f"{index_file}.tmp"
+            try:
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(temp_file, index_file)
+            except Exception as e:
+                logger.error(f"保存图片索引失败: {str(e)}")
+                with self.lock:
+                    if index_file == self.index_file:
+                        self._dirty = True
+            self._last_saved = time.monotonic()
+    
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "files": len(self.files),
+                "unique_images": len(self.hashes),
+                "urls": len(self.urls)
+            }
+
+# 导出默认去重索引实例
+dedup_service = DedupService()
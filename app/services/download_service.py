@@ -1,30 +1,129 @@
 import os
 import time
+import random
+import asyncio
+import uuid
+import shutil
 import threading
-from typing import Optional
+import mimetypes
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Optional, List
+from urllib.parse import urlparse, urljoin, parse_qsl
+
 import aiohttp
 
-from app.models.download import DownloadTask, DownloadStatus
+from app.models.api import ResolutionKind
+from app.models.download import DownloadTask, DownloadStatus, PreloadItem
 from app.network.http_client import http_client
 from app.services.api_service import api_service
+from app.services.config_service import config_service
+from app.services.dedup_service import dedup_service
+from app.services.extractor_service import extractor_service, IMAGE_EXTENSIONS
+from app.services.health_service import health_service
+from app.services.resolution_service import resolution_service, REDIRECT_STATUSES
+from app.utils.file_writer import AsyncFileWriter, choose_chunk_size
+from app.utils.progress import ProgressAggregator
+from app.utils.metrics import metrics, SIZE_BUCKETS
 from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+PART_SUFFIX = '.part'
+# 可以通过Range请求继续下载的传输中断错误
+RESUMABLE_ERRORS = (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
 class DownloadService:
     def __init__(self, download_dir: str = "Download"):
         self.download_dir = download_dir
         self.current_task: Optional[DownloadTask] = None
         self.is_downloading = False  # 标记是否正在下载
-        self.preload_pool = []  # 存储元组 (image_url, api_name)
+        self.preload_pool: List[PreloadItem] = []  # 预加载的图片，尽量预先下载图片内容到暂存目录
         self.preload_size = 3
+        # 多图API一次返回的其余图片URL，补充预加载池时优先暂存这些图片，不必再次请求API
+        self.harvest_pool: List[PreloadItem] = []
+        self.harvest_pool_size = 20
+        # 支持参数的API在预加载时一次请求多张图片（附加 num=N），1表示不批量请求
+        self.preload_batch_size = config_service.get_preload_batch_size()
+        self.batch_param = 'num'
+        self._batch_unsupported = set()  # 批量请求仍只返回一张图片的API，之后不再附加数量参数
+        self.staging_max_bytes = 64 * 1024 * 1024  # 暂存目录的字节预算，超出时只预加载图片URL
+        self.staged_bytes = 0
+        self.preload_concurrency = 4  # 同时进行的预加载请求数
+        # 预加载调度水位：池中数量降到低水位时补充到高水位（即池的容量）
+        self.preload_low_watermark = 1
+        self.api_cache_low_watermark = 2
+        self.prefetch_max_backoff = 30  # 预加载连续失败时的最大等待秒数
         self.api_cache_pool = []  # 存储随机API名称，最多5个
         self.api_cache_size = 5
+        self.batch_max_attempts = 3  # 批量下载时单个任务最多尝试的API数
+        # 对冲请求：API在hedge_delay秒内没有结果时并行尝试下一个API，最多同时请求hedge_max_in_flight个
+        self.hedge_delay = 1.5
+        self.hedge_max_in_flight = 3
+        self.max_resume_attempts = 3  # 单张图片传输中断后最多续传的次数
+        self.duplicate_mode = config_service.get_duplicate_mode()  # skip / hardlink / keep
         self.lock = threading.RLock()
+        # 预加载调度任务及其唤醒事件，只在网络事件循环线程中访问
+        self._prefetch_task: Optional[asyncio.Task] = None
+        self._prefetch_wakeup: Optional[asyncio.Event] = None
         
+        self.set_download_dir(download_dir)
+    
+    def set_download_dir(self, download_dir: str):
+        # 暂存的图片位于旧下载目录中，切换目录前先清空预加载池
+        self.clear_preload_pool()
+        self.download_dir = download_dir
+        # 暂存目录位于下载目录内，保证完成下载时可以原子重命名
+        self.staging_dir = os.path.join(self.download_dir, '.prefetch')
         if not os.path.exists(self.download_dir):
             os.makedirs(self.download_dir)
             logger.info(f"创建下载目录: {self.download_dir}")
+        self._reset_staging_dir()
+        self._remove_stale_parts()
+        dedup_service.load(self.download_dir)
+    
+    def _reset_staging_dir(self):
+        """创建暂存目录并清理上次运行遗留的暂存文件"""
+        try:
+            if os.path.exists(self.staging_dir):
+                shutil.rmtree(self.staging_dir, ignore_errors=True)
+            os.makedirs(self.staging_dir, exist_ok=True)
+        except Exception as e:
+            logger.error(f"初始化暂存目录失败: {str(e)}")
+    
+    def _remove_stale_parts(self):
+        """删除上次运行中断时遗留的 .part 临时文件"""
+        try:
+            for entry in os.scandir(self.download_dir):
+                if entry.is_file() and entry.name.endswith(PART_SUFFIX):
+                    os.remove(entry.path)
+                    logger.info(f"删除未完成的下载: {entry.name}")
+        except OSError as e:
+            logger.error(f"清理未完成的下载失败: {str(e)}")
+    
+    def clear_preload_pool(self):
+        """清空预加载池并删除已暂存的图片"""
+        with self.lock:
+            items = list(self.preload_pool)
+            self.preload_pool.clear()
+            self.harvest_pool.clear()
+        for item in items:
+            self._discard_staged_item(item)
+    
+    def invalidate_apis(self, api_names):
+        """从预加载池和API缓存池中移除来自指定API的条目，其余预加载结果保留"""
+        names = set(api_names)
+        if not names:
+            return
+        with self.lock:
+            removed = [item for item in self.preload_pool if item.api_name in names]
+            self.preload_pool = [item for item in self.preload_pool if item.api_name not in names]
+            self.harvest_pool = [item for item in self.harvest_pool if item.api_name not in names]
+            self._batch_unsupported -= names
+            self.api_cache_pool = [name for name in self.api_cache_pool if name not in names]
+        for item in removed:
+            self._discard_staged_item(item)
+        if removed:
+            logger.info(f"已移除 {len(removed)} 个来自已变化API的预加载图片")
     
     def get_random_api_name(self) -> Optional[str]:
         try:
@@ -38,195 +137,76 @@ class DownloadService:
             return None
     
     def download(self, progress_callback=None, api_change_callback=None) -> tuple[Optional[str], Optional[str]]:
+        """下载一张图片，返回 (保存路径, API名称)
+        
+        progress_callback(info: ProgressInfo) 在整数百分比变化时调用（有频率上限），下载成功时最后以100%调用一次
+        """
+        # 检查是否正在下载，防止并发下载
+        with self.lock:
+            if self.is_downloading:
+                logger.warning("正在下载中，请勿重复点击")
+                return None, None
+            self.is_downloading = True
+        
         try:
-            # 检查是否正在下载，防止并发下载
-            with self.lock:
-                if self.is_downloading:
-                    logger.warning("正在下载中，请勿重复点击")
-                    return None, None
-                self.is_downloading = True
-            
-            image_url = None
+            save_path = None
             actual_api_name = None
             
-            # 首先从预加载池获取
-            with self.lock:
-                if self.preload_pool:
-                    try:
-                        preload_item = self.preload_pool.pop(0)
-                        image_url = preload_item[0]
-                        actual_api_name = preload_item[1]
-                        # 立即通知回调函数实际使用的API名称
-                        if api_change_callback:
-                            try:
-                                api_change_callback(actual_api_name)
-                            except Exception as e:
-                                logger.error(f"调用API变化回调失败: {str(e)}")
-                    except IndexError:
-                        pass
-                    except Exception as e:
-                        logger.error(f"从预加载池获取失败: {str(e)}")
-            
-            # 如果预加载池为空，从API缓存池中获取API名称
-            if not image_url or not actual_api_name:
-                # 从API缓存池中取出一个API名称
-                api_name = None
+            with metrics.span("download") as span:
+                # 创建下载任务
                 with self.lock:
-                    if self.api_cache_pool:
-                        try:
-                            api_name = self.api_cache_pool.pop(0)
-                        except Exception as e:
-                            logger.error(f"从API缓存池获取失败: {str(e)}")
+                    self.current_task = DownloadTask(url="", status=DownloadStatus.DOWNLOADING)
                 
-                # 如果API缓存池为空，获取一个随机API
-                if not api_name:
+                def report_progress(info):
                     try:
-                        api_config = api_service.get_random_api()
-                        if not api_config:
-                            logger.error("没有可用的API")
-                            # 重置下载状态
-                            try:
-                                with self.lock:
-                                    self.is_downloading = False
-                            except Exception:
-                                pass
-                            return None, None
-                        
-                        actual_api_name = api_config.name
-                        # 立即通知回调函数实际使用的API名称
-                        if api_change_callback:
-                            try:
-                                api_change_callback(actual_api_name)
-                            except Exception as e:
-                                logger.error(f"调用API变化回调失败: {str(e)}")
-                        image_url = self._get_image_url(api_config)
-                    except Exception as e:
-                        logger.error(f"获取随机API失败: {str(e)}")
-                else:
-                    # 使用从API缓存池中取出的API名称
-                    try:
-                        api_config = api_service.get_api_by_name(api_name)
-                        if not api_config:
-                            logger.error(f"API {api_name} 不存在")
-                        else:
-                            actual_api_name = api_config.name
-                            # 立即通知回调函数实际使用的API名称
-                            if api_change_callback:
-                                try:
-                                    api_change_callback(actual_api_name)
-                                except Exception as e:
-                                    logger.error(f"调用API变化回调失败: {str(e)}")
-                            image_url = self._get_image_url(api_config)
+                        with self.lock:
+                            if self.current_task:
+                                self.current_task.progress = info.percent
+                                self.current_task.total_size = info.total
+                                self.current_task.speed = info.speed
+                        if progress_callback:
+                            progress_callback(info)
                     except Exception as e:
-                        logger.error(f"使用API缓存池中的API失败: {str(e)}")
+                        logger.error(f"进度回调失败: {str(e)}")
                 
-                # 如果获取失败，尝试其他API
-                if not image_url:
-                    # 尝试从API缓存池中获取下一个API名称
-                    try:
-                        while True:
-                            next_api_name = None
-                            with self.lock:
-                                if self.api_cache_pool:
-                                    try:
-                                        next_api_name = self.api_cache_pool.pop(0)
-                                    except Exception as e:
-                                        logger.error(f"从API缓存池获取失败: {str(e)}")
-                            
-                            if not next_api_name:
-                                break
-                            
-                            next_api_config = api_service.get_api_by_name(next_api_name)
-                            if not next_api_config:
-                                continue
-                            
-                            # 立即通知回调函数实际使用的API名称
-                            if api_change_callback:
-                                try:
-                                    api_change_callback(next_api_config.name)
-                                except Exception as e:
-                                    logger.error(f"调用API变化回调失败: {str(e)}")
-                            
-                            image_url = self._get_image_url(next_api_config)
-                            if image_url:
-                                actual_api_name = next_api_config.name
-                                break
-                    except Exception as e:
-                        logger.error(f"尝试其他API失败: {str(e)}")
-                    
-                    # 如果API缓存池中没有更多API名称，尝试所有启用的API
-                if not image_url:
-                    try:
-                        enabled_apis = [api for api in api_service.get_apis() if api.enabled]
-                        if not enabled_apis:
-                            logger.error("没有启用的API")
-                            # 重置下载状态
-                            try:
-                                with self.lock:
-                                    self.is_downloading = False
-                            except Exception:
-                                pass
-                            return None, None
-                        
-                        for other_api in enabled_apis:
-                            if other_api.name != actual_api_name:
-                                # 立即通知回调函数实际使用的API名称
-                                if api_change_callback:
-                                    try:
-                                        api_change_callback(other_api.name)
-                                    except Exception as e:
-                                        logger.error(f"调用API变化回调失败: {str(e)}")
-                                
-                                image_url = self._get_image_url(other_api)
-                                if image_url:
-                                    actual_api_name = other_api.name
-                                    break
-                    except Exception as e:
-                        logger.error(f"尝试所有启用的API失败: {str(e)}")
+                # 下载层按块报告字节数，由聚合器合并后再通知界面
+                progress = ProgressAggregator(report_progress)
+                on_progress = progress.update
                 
-                if not image_url:
-                    logger.error("无法获取图片URL")
-                    # 重置下载状态
-                    try:
-                        with self.lock:
-                            self.is_downloading = False
-                    except Exception:
-                        pass
-                    return None, None
-            
-
-            
-            # 创建下载任务
-            try:
+                # 首先从预加载池获取，预加载池为空时使用多图API返回的其余图片URL
+                preload_item = None
                 with self.lock:
-                    self.current_task = DownloadTask(
-                        url=image_url,
-                        status=DownloadStatus.DOWNLOADING,
-                        api_name=actual_api_name
-                    )
-            except Exception as e:
-                logger.error(f"创建下载任务失败: {str(e)}")
-            
-            def on_progress(progress, total_size):
-                try:
-                    with self.lock:
-                        if self.current_task:
-                            self.current_task.progress = progress
-                            self.current_task.total_size = total_size
-                    if progress_callback:
-                        progress_callback(progress, total_size)
-                except Exception as e:
-                    logger.error(f"进度回调失败: {str(e)}")
-            
-            # 下载图片
-            save_path = None
-            try:
-                save_path = self._download_image(image_url, actual_api_name, on_progress)
-            except Exception as e:
-                logger.error(f"下载图片失败: {str(e)}")
-            
-            # 立即更新任务状态，不等待预加载
-            try:
+                    if self.preload_pool:
+                        preload_item = self.preload_pool.pop(0)
+                    elif self.harvest_pool:
+                        preload_item = self.harvest_pool.pop(0)
+                
+                if preload_item:
+                    span.labels["source"] = "preload" if preload_item.is_staged else "preload_url"
+                    metrics.inc("preload_hits_total", kind=span.labels["source"])
+                    actual_api_name = preload_item.api_name
+                    self._notify_api_change(api_change_callback, actual_api_name)
+                    self._update_current_task(preload_item.image_url, actual_api_name)
+                    if preload_item.is_staged:
+                        save_path = self._commit_staged_item(preload_item, on_progress)
+                    if not save_path:
+                        save_path = self._download_image(preload_item.image_url, actual_api_name, on_progress)
+                    if not save_path:
+                        logger.warning(f"预加载图片下载失败，改为从API获取: {preload_item.image_url}")
+                
+                # 预加载池为空或预加载的图片下载失败时，依次尝试候选API
+                if not save_path:
+                    if not preload_item:
+                        metrics.inc("preload_misses_total")
+                    span.labels["source"] = "api"
+                    save_path, actual_api_name = self._download_from_apis(on_progress, api_change_callback)
+                
+                if save_path:
+                    progress.finish()
+                else:
+                    span.status = "failed"
+                
+                # 立即更新任务状态，不等待预加载
                 with self.lock:
                     if self.current_task:
                         if save_path:
@@ -237,25 +217,11 @@ class DownloadService:
                             self.current_task.status = DownloadStatus.FAILED
                             self.current_task.error_message = "下载失败"
                             logger.error("图片下载失败")
-            except Exception as e:
-                logger.error(f"更新任务状态失败: {str(e)}")
             
-            # 异步执行预加载，不阻塞主线程
-            try:
-                preload_thread = threading.Thread(target=self._preload_images)
-                preload_thread.daemon = True
-                preload_thread.start()
-            except Exception as e:
-                logger.error(f"启动预加载线程失败: {str(e)}")
-            finally:
-                # 重置下载状态
-                try:
-                    with self.lock:
-                        self.is_downloading = False
-                except Exception:
-                    pass
+            # 唤醒后台预加载调度任务补充预加载池，不阻塞当前线程；在span外启动，调度任务不属于这次下载
+            self.start_prefetch()
             
-            return save_path, actual_api_name
+            return save_path, actual_api_name if save_path else None
         except Exception as e:
             logger.error(f"下载失败: {str(e)}")
             try:
@@ -265,262 +231,1009 @@ class DownloadService:
                         self.current_task.error_message = str(e)
             except Exception as e2:
                 logger.error(f"更新任务状态失败: {str(e2)}")
-            finally:
-                # 重置下载状态
-                try:
-                    with self.lock:
-                        self.is_downloading = False
-                except Exception:
-                    pass
             return None, None
+        finally:
+            # 重置下载状态
+            with self.lock:
+                self.is_downloading = False
+    
+    def _notify_api_change(self, api_change_callback, api_name: str):
+        """立即通知回调函数实际使用的API名称"""
+        if api_change_callback:
+            try:
+                api_change_callback(api_name)
+            except Exception as e:
+                logger.error(f"调用API变化回调失败: {str(e)}")
+    
+    def _update_current_task(self, url: str, api_name: str):
+        with self.lock:
+            if self.current_task:
+                self.current_task.url = url
+                self.current_task.api_name = api_name
+    
+    def _iter_candidate_apis(self):
+        """按优先级依次产出候选API：API缓存池中的API或随机API，然后是缓存池中的其余API，最后按健康状态排序的所有启用的API"""
+        tried = set()
+        
+        # 从API缓存池中取出一个API名称，缓存池为空时获取一个随机API
+        api_config = None
+        with self.lock:
+            api_name = self.api_cache_pool.pop(0) if self.api_cache_pool else None
+        if api_name:
+            api_config = api_service.get_api_by_name(api_name)
+            if not api_config:
+                logger.error(f"API {api_name} 不存在")
+        else:
+            api_config = api_service.get_random_api()
+        
+        if api_config:
+            tried.add(api_config.name)
+            yield api_config
+        
+        # 如果获取失败，尝试API缓存池中的其他API
+        while True:
+            with self.lock:
+                next_api_name = self.api_cache_pool.pop(0) if self.api_cache_pool else None
+            if not next_api_name:
+                break
+            # 隔离中的API留到最后再尝试
+            if next_api_name in tried or health_service.is_quarantined(next_api_name):
+                continue
+            next_api_config = api_service.get_api_by_name(next_api_name)
+            if next_api_config:
+                tried.add(next_api_config.name)
+                yield next_api_config
+        
+        # 如果API缓存池中没有更多API名称，按健康状态从好到差尝试所有启用的API
+        for other_api in health_service.rank([api for api in api_service.get_apis() if api.enabled]):
+            if other_api.name not in tried:
+                tried.add(other_api.name)
+                yield other_api
+    
+    def _download_from_apis(self, progress_callback=None, api_change_callback=None) -> tuple[Optional[str], Optional[str]]:
+        """使用候选API获取并下载图片，返回 (保存路径, API名称)"""
+        try:
+            save_path, image_url, api_config = self._run_async(
+                self._hedged_fetch_async(self._iter_candidate_apis(), progress_callback, api_change_callback)
+            )
+        except Exception as e:
+            logger.error(f"使用候选API下载失败: {str(e)}")
+            return None, None
+        
+        if not save_path:
+            logger.error("无法获取图片URL")
+            return None, None
+        self._update_current_task(image_url, api_config.name)
+        return save_path, api_config.name
     
-    async def _get_image_url_async(self, api_config) -> Optional[str]:
+    async def _hedged_fetch_async(self, candidates, progress_callback=None, api_change_callback=None):
+        """对冲请求：首个API在hedge_delay秒内没有结果时并行请求下一个API，最多同时hedge_max_in_flight个
+        
+        第一个解析出图片的API继续下载，其余请求立即取消；返回 (保存路径, 图片URL, API配置)
+        """
+        candidates = iter(candidates)
+        in_flight = {}  # asyncio.Task -> ApiConfig
+        winner = None
+        exhausted = False
+        
+        def claim(api_config) -> bool:
+            nonlocal winner
+            if winner is None:
+                winner = api_config
+                for task, other_api in in_flight.items():
+                    if other_api is not api_config:
+                        task.cancel()
+                self._notify_api_change(api_change_callback, api_config.name)
+                self._update_current_task("", api_config.name)
+            return winner is api_config
+        
+        def launch() -> bool:
+            with metrics.span("api_selection"):
+                api_config = next(candidates, None)
+            if api_config is None:
+                return False
+            if not in_flight:
+                self._notify_api_change(api_change_callback, api_config.name)
+                self._update_current_task("", api_config.name)
+            else:
+                metrics.inc("hedged_requests_total")
+                logger.info(f"对冲请求: 并行尝试API {api_config.name}")
+            task = asyncio.ensure_future(self._fetch_image_async(api_config, progress_callback, on_resolved=claim))
+            in_flight[task] = api_config
+            return True
+        
+        launch_next = True
         try:
-            api_url = api_config.url
-            if api_config.params:
-                if "?" in api_url:
-                    api_url = f"{api_url}&{api_config.params}"
-                else:
-                    api_url = f"{api_url}?{api_config.params}"
+            while True:
+                if launch_next and not exhausted and winner is None and len(in_flight) < self.hedge_max_in_flight:
+                    exhausted = not launch()
+                launch_next = False
+                
+                if not in_flight:
+                    if exhausted:
+                        return None, None, None
+                    launch_next = True
+                    continue
+                
+                # 还可以追加对冲请求时，最多等待hedge_delay秒
+                can_hedge = winner is None and not exhausted and len(in_flight) < self.hedge_max_in_flight
+                done, _ = await asyncio.wait(
+                    in_flight.keys(),
+                    timeout=self.hedge_delay if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    launch_next = True
+                    continue
+                
+                for task in done:
+                    api_config = in_flight.pop(task)
+                    if task.cancelled():
+                        continue
+                    save_path, image_url = task.result()
+                    if save_path:
+                        return save_path, image_url, api_config
+                    # 失败的请求立即由下一个候选API补上；获胜的API下载失败时重新开始竞争
+                    if winner is api_config:
+                        winner = None
+                    launch_next = True
+        finally:
+            for task in in_flight:
+                task.cancel()
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+    
+    def _build_api_url(self, api_config, batch_size: int = 1) -> str:
+        """拼接API地址；batch_size大于1且API支持参数时附加数量参数，一次请求多张图片"""
+        api_url = api_config.url
+        params = api_config.params
+        if batch_size > 1 and self._accepts_batch(api_config):
+            batch_query = f"{self.batch_param}={batch_size}"
+            params = f"{params}&{batch_query}" if params else batch_query
+        if params:
+            if "?" in api_url:
+                api_url = f"{api_url}&{params}"
+            else:
+                api_url = f"{api_url}?{params}"
+        return api_url
+    
+    def _accepts_batch(self, api_config) -> bool:
+        """API支持参数、地址中没有指定数量且之前的批量请求没有失效时，才附加数量参数"""
+        if not api_config.supports_params or api_config.name in self._batch_unsupported:
+            return False
+        query = urlparse(api_config.url).query
+        if api_config.params:
+            query = f"{query}&{api_config.params}"
+        return all(key != self.batch_param for key, _ in parse_qsl(query, keep_blank_values=True))
+    
+    async def _fetch_image_async(self, api_config, progress_callback=None, on_resolved=None) -> tuple[Optional[str], Optional[str]]:
+        """请求API并下载图片，返回 (保存路径, 图片URL)
+        
+        API直接返回图片时，将第一次响应的内容直接写入磁盘，不再重复下载
+        on_resolved(api_config) 在解析出图片后、开始下载前调用，返回False时放弃下载
+        """
+        try:
+            api_url = self._build_api_url(api_config)
             
-            response = await http_client.async_get(api_url)
-            content_type = response.headers.get('Content-Type', '')
+            async with AsyncExitStack() as stack:
+                direct_response = None
+                with metrics.span("resolve", api=api_config.name):
+                    resolved = await self._resolve_redirect_async(api_config, api_url)
+                    if resolved:
+                        image_url, ttfb = resolved
+                        image_urls = [image_url]
+                    else:
+                        started = time.monotonic()
+                        response = await stack.enter_async_context(
+                            http_client.async_stream(api_url, timeout=http_client.download_timeout)
+                        )
+                        ttfb = self._observe_ttfb(api_config.name, started)
+                        resolution_service.record(api_config.name, resolution_service.classify(response))
+                        content_type = response.headers.get('Content-Type', '')
+                        final_url = str(response.url)
+                        if 'image/' in content_type:
+                            direct_response = response
+                        else:
+                            content = await response.read()
+                            image_urls = self._extract_image_urls(api_config, content, content_type, final_url, api_url)
+                
+                # 直接返回图片时，resolve只计到收到响应头为止，图片内容的传输单独计时
+                if direct_response is not None:
+                    logger.info(f"直接返回图片: {final_url}")
+                    if on_resolved and not on_resolved(api_config):
+                        return None, None
+                    transfer_started = time.monotonic()
+                    with metrics.span("transfer", api=api_config.name):
+                        save_path = await self._save_response_async(direct_response, final_url, progress_callback)
+                    self._record_transfer(api_config.name, ttfb, os.path.getsize(save_path), transfer_started)
+                    logger.info(f"图片下载成功: {save_path}")
+                    return save_path, final_url
             
-            # 处理直接返回图片的情况（内容类型为图片类型）
-            if 'image/' in content_type:
-                logger.info(f"直接返回图片: {response.url}")
-                return response.url
+            image_url = image_urls[0] if image_urls else None
+            if not image_url:
+                logger.error(f"API {api_config.name} 未返回图片URL")
+                health_service.record_failure(api_config.name)
+                return None, None
             
-            # 处理JSON响应的情况
-            if 'application/json' in content_type or 'text/json' in content_type:
+            if on_resolved and not on_resolved(api_config):
+                return None, None
+            self._harvest_urls(api_config.name, image_urls[1:])
+            transfer_started = time.monotonic()
+            save_path, reused = await self._download_image_async(image_url, api_config.name, progress_callback)
+            if reused:
+                # 复用已下载的文件没有发生传输，只记录API请求成功，不计入下载速度
+                health_service.record_success(api_config.name, ttfb)
+            elif save_path:
+                self._record_transfer(api_config.name, ttfb, os.path.getsize(save_path), transfer_started)
+            else:
+                health_service.record_failure(api_config.name)
+            return save_path, image_url
+        except Exception as e:
+            logger.error(f"从API {api_config.name} 获取图片失败: {str(e)}")
+            health_service.record_failure(api_config.name)
+            return None, None
+    
+    async def _resolve_redirect_async(self, api_config, api_url: str) -> Optional[tuple[str, float]]:
+        """重定向型API不跟随重定向、不读取响应体，直接从Location响应头得到图片URL，返回 (图片URL, 首字节时间)
+        
+        API没有重定向档案，或响应不再是重定向时返回None（后者同时使档案失效），由调用方改用普通请求
+        """
+        if resolution_service.get(api_config.name) is not ResolutionKind.REDIRECT:
+            return None
+        started = time.monotonic()
+        async with http_client.async_stream(api_url, allow_redirects=False) as response:
+            ttfb = self._observe_ttfb(api_config.name, started)
+            location = response.headers.get('Location', '')
+            is_redirect = response.status in REDIRECT_STATUSES
+        if not is_redirect or not location:
+            resolution_service.invalidate(api_config.name)
+            return None
+        image_url = urljoin(api_url, location)
+        logger.info(f"API {api_config.name} 重定向到: {image_url}")
+        return image_url, ttfb
+    
+    def _observe_ttfb(self, api_name: str, started: float) -> float:
+        """记录API请求从发出到收到响应头的时间并返回"""
+        ttfb = time.monotonic() - started
+        metrics.observe("api_ttfb_seconds", ttfb, api=api_name)
+        return ttfb
+    
+    def _record_transfer(self, api_name: str, ttfb: float, size: int, transfer_started: float):
+        """记录一次成功的图片传输，用于API健康评分"""
+        health_service.record_success(api_name, ttfb, size, time.monotonic() - transfer_started)
+    
+    def _extract_image_urls(self, api_config, content: bytes, content_type: str, final_url: str, api_url: str) -> List[str]:
+        """从API响应内容中解析候选图片URL；只有API返回图片列表时才有多个，第一个之后的可以收集到多图池"""
+        return extractor_service.extract(api_config, content, content_type, final_url, api_url)
+    
+    def _run_async(self, coro):
+        """在共享的网络事件循环线程中运行异步函数并返回结果"""
+        return http_client.run(coro)
+    
+    async def _download_image_async(self, url: str, api_name: str, progress_callback=None) -> tuple[Optional[str], bool]:
+        """下载图片，返回 (保存路径, 是否复用了已下载的文件)"""
+        try:
+            with metrics.span("transfer", api=api_name) as span:
+                # 之前下载过的图片URL不再重复下载
+                existing_path = dedup_service.find_by_url(url) if self.duplicate_mode != 'keep' else None
+                if existing_path:
+                    span.status = "reused"
+                    save_path = self._reuse_downloaded(existing_path, url)
+                    if progress_callback:
+                        size = os.path.getsize(save_path)
+                        progress_callback(size, size)
+                    return save_path, True
+                
+                async with http_client.async_stream(url, timeout=http_client.download_timeout) as response:
+                    save_path = await self._save_response_async(response, url, progress_callback)
+                logger.info(f"图片下载成功: {save_path}")
+                return save_path, False
+        except Exception as e:
+            logger.error(f"下载图片失败: {str(e)}")
+            return None, False
+    
+    async def _save_response_async(self, response, url: str, progress_callback=None) -> str:
+        """将响应内容流式写入 .part 临时文件，完成后原子地重命名到下载目录，返回保存路径
+        
+        传输中断且服务器支持Range请求时，从已接收的位置继续下载
+        """
+        total_size = int(response.headers.get('content-length', 0))
+        downloaded_size = 0
+        first_headers = response.headers
+        
+        save_path = self._reserve_save_path(url, response.headers.get('Content-Type', ''), PART_SUFFIX)
+        part_path = save_path + PART_SUFFIX
+        hasher = dedup_service.new_hasher()
+        # 磁盘写入和哈希计算在写入线程中进行，不阻塞事件循环
+        writer = AsyncFileWriter(part_path, total_size, hasher)
+        resume_attempts = 0
+        try:
+            async with AsyncExitStack() as stack:
+                await writer.open()
+                while True:
+                    try:
+                        async for chunk in response.content.iter_chunked(choose_chunk_size(total_size)):
+                            if chunk:
+                                await http_client.throttle_download(len(chunk))
+                                await writer.write(chunk)
+                                downloaded_size += len(chunk)
+                                if progress_callback:
+                                    progress_callback(downloaded_size, total_size)
+                        if downloaded_size < total_size and self._is_identity_encoded(first_headers):
+                            raise aiohttp.ClientPayloadError(f"响应内容不完整: {downloaded_size}/{total_size} 字节")
+                        break
+                    except RESUMABLE_ERRORS as e:
+                        if resume_attempts >= self.max_resume_attempts or not self._can_resume(first_headers, url, total_size):
+                            raise
+                        resume_attempts += 1
+                        metrics.inc("download_resumes_total")
+                        logger.warning(f"下载中断（{str(e) or type(e).__name__}），从第 {downloaded_size} 字节继续下载: {url}")
+                        response = await stack.enter_async_context(
+                            self._open_range_async(url, first_headers, downloaded_size, total_size)
+                        )
+            await writer.close()
+            # 下载完成后才出现在最终路径，中断的下载不会留下不完整的图片
+            os.replace(part_path, save_path)
+        except BaseException:
+            await writer.abort()
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+        
+        metrics.inc("download_bytes_total", downloaded_size)
+        metrics.observe("image_size_bytes", downloaded_size, buckets=SIZE_BUCKETS)
+        save_path = self._dedup_saved_file(save_path, hasher.hexdigest(), url)
+        if progress_callback:
+            # 总大小未知时仍报告0，由ProgressAggregator.finish按实际字节数补全
+            progress_callback(downloaded_size, total_size)
+        return save_path
+    
+    def _can_resume(self, headers, url: str, total_size: int) -> bool:
+        """服务器声明支持字节范围请求、大小已知且内容未被压缩编码时才能断点续传
+        
+        直接返回随机图片的API地址每次请求得到不同的图片，不能续传
+        """
+        if total_size <= 0 or headers.get('Accept-Ranges', '').lower() != 'bytes':
+            return False
+        if not self._is_identity_encoded(headers):
+            return False
+        return not self._is_api_url(url)
+    
+    def _is_identity_encoded(self, headers) -> bool:
+        # 压缩编码的响应在读取时被自动解压，已接收的字节数与Content-Length和Range偏移不对应
+        return headers.get('Content-Encoding', 'identity').lower() == 'identity'
+    
+    @asynccontextmanager
+    async def _open_range_async(self, url: str, headers, offset: int, total_size: int):
+        """从offset处请求剩余内容；用If-Range确保服务器上的图片没有变化"""
+        range_headers = {'Range': f'bytes={offset}-'}
+        etag = headers.get('ETag', '')
+        if etag and not etag.startswith('W/'):
+            range_headers['If-Range'] = etag
+        elif headers.get('Last-Modified'):
+            range_headers['If-Range'] = headers['Last-Modified']
+        
+        async with http_client.async_stream(url, headers=range_headers, timeout=http_client.download_timeout) as response:
+            content_range = response.headers.get('Content-Range', '')
+            if response.status != 206 or not content_range.startswith(f"bytes {offset}-") \
+                    or not content_range.endswith(f"/{total_size}"):
+                # 服务器忽略了Range或图片已变化，已下载的部分不能使用
+                raise aiohttp.ClientPayloadError(f"服务器未按请求返回剩余内容: {response.status} {content_range}")
+            yield response
+    
+    def _is_api_url(self, url: str) -> bool:
+        """判断URL是否为API地址本身（直接返回随机图片的API），这类URL每次返回不同的图片，不能用于去重"""
+        base_url = url.split('?', 1)[0]
+        return any(base_url == api.url.split('?', 1)[0] for api in api_service.get_apis())
+    
+    def _dedup_saved_file(self, save_path: str, content_hash: str, url: str) -> str:
+        """登记新保存的图片；与已下载的图片内容相同时按duplicate_mode处理，返回最终的图片路径"""
+        index_url = None if self._is_api_url(url) else url
+        if self.duplicate_mode == 'keep':
+            dedup_service.add(content_hash, save_path, index_url)
+            return save_path
+        
+        existing_path = dedup_service.claim(content_hash, save_path, index_url)
+        if not existing_path:
+            return save_path
+        
+        if self.duplicate_mode == 'hardlink' and self._link_duplicate(existing_path, save_path):
+            dedup_service.add(content_hash, save_path)
+            logger.info(f"图片与已下载的 {existing_path} 相同，已创建硬链接: {save_path}")
+            return save_path
+        if self.duplicate_mode == 'hardlink':
+            # 无法创建硬链接（如文件系统不支持）时保留下载的副本
+            dedup_service.add(content_hash, save_path)
+            return save_path
+        
+        try:
+            os.remove(save_path)
+        except OSError as e:
+            logger.error(f"删除重复图片失败: {str(e)}")
+            return save_path
+        logger.info(f"图片与已下载的 {existing_path} 相同，跳过保存")
+        return existing_path
+    
+    def _reuse_downloaded(self, existing_path: str, url: str) -> str:
+        """图片URL已下载过时不发起请求：skip模式直接返回已有文件，hardlink模式创建新的硬链接"""
+        if self.duplicate_mode == 'hardlink':
+            save_path = self._reserve_save_path(existing_path)
+            if self._link_duplicate(existing_path, save_path):
+                dedup_service.add(dedup_service.urls[url], save_path)
+                logger.info(f"图片URL已下载过，已创建硬链接: {save_path}")
+                return save_path
+            try:
+                os.remove(save_path)
+            except OSError:
+                pass
+        logger.info(f"图片URL已下载过，跳过下载: {url} -> {existing_path}")
+        return existing_path
+    
+    def _link_duplicate(self, existing_path: str, save_path: str) -> bool:
+        """用指向已有文件的硬链接原子地替换save_path"""
+        link_path = f"{save_path}.link"
+        try:
+            os.link(existing_path, link_path)
+            os.replace(link_path, save_path)
+            return True
+        except OSError as e:
+            logger.warning(f"创建硬链接失败: {str(e)}")
+            try:
+                os.remove(link_path)
+            except OSError:
+                pass
+            return False
+    
+    def _guess_extension(self, url: str, content_type: str = "") -> str:
+        """根据URL路径或响应的Content-Type推断图片扩展名"""
+        ext = os.path.splitext(urlparse(url).path)[1].lower()
+        if ext in IMAGE_EXTENSIONS:
+            return ext
+        mime_type = content_type.split(';', 1)[0].strip().lower()
+        if mime_type.startswith('image/'):
+            guessed = mimetypes.guess_extension(mime_type)
+            if guessed:
+                return '.jpg' if guessed in ('.jpe', '.jfif') else guessed
+        return ext or '.jpg'
+    
+    def _reserve_save_path(self, url: str, content_type: str = "", suffix: str = "") -> str:
+        """生成唯一的保存路径并以 保存路径+suffix 占位，避免并发下载时文件名冲突"""
+        timestamp = time.strftime('%Y%m%d_%H%M%S')
+        ext = self._guess_extension(url, content_type)
+        file_name = f"{timestamp}{ext}"
+        with self.lock:
+            while True:
+                save_path = os.path.join(self.download_dir, file_name)
+                # 最终文件和正在下载的 .part 临时文件都不存在时才使用该文件名
+                if not os.path.exists(save_path) and not os.path.exists(save_path + PART_SUFFIX):
+                    try:
+                        # 以独占模式创建空文件占位，同一秒内的并发任务会得到不同的文件名
+                        with open(save_path + suffix, 'xb'):
+                            pass
+                        return save_path
+                    except FileExistsError:
+                        pass
+                random_suffix = random.randint(1000, 9999)
+                file_name = f"{timestamp}_{random_suffix}{ext}"
+    
+    def _download_image(self, url: str, api_name: str, progress_callback=None) -> Optional[str]:
+        try:
+            save_path, _ = self._run_async(self._download_image_async(url, api_name, progress_callback))
+            return save_path
+        except Exception as e:
+            logger.error(f"同步下载图片失败: {str(e)}")
+            return None
+    
+    def download_batch(self, count: int, concurrency: int = 4, progress_callback=None) -> List[DownloadTask]:
+        """批量并发下载图片，所有任务在同一个事件循环中执行
+        
+        progress_callback(completed, total, task) 在每个任务结束时调用
+        """
+        if count <= 0:
+            return []
+        concurrency = max(1, min(concurrency, count))
+        try:
+            return self._run_async(self._download_batch_async(count, concurrency, progress_callback))
+        except Exception as e:
+            logger.error(f"批量下载失败: {str(e)}")
+            return []
+    
+    async def _download_batch_async(self, count: int, concurrency: int, progress_callback=None) -> List[DownloadTask]:
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [DownloadTask(url="") for _ in range(count)]
+        completed = 0
+        
+        async def run_task(task: DownloadTask):
+            nonlocal completed
+            async with semaphore:
+                await self._run_batch_task_async(task)
+            completed += 1
+            if progress_callback:
                 try:
-                    data = response.json()
-                    if isinstance(data, dict):
-                        # 处理有data字段的情况
-                        if 'data' in data:
-                            data_value = data['data']
-                            
-                            # 处理data为字符串的情况
-                            if isinstance(data_value, str):
-                                return data_value.strip()
-                            
-                            # 处理data为字典的情况
-                            elif isinstance(data_value, dict):
-                                # 检查字典中的url字段
-                                if 'url' in data_value:
-                                    return data_value['url'].strip()
-                                # 检查字典中的urls字段
-                                elif 'urls' in data_value and isinstance(data_value['urls'], dict):
-                                    if 'original' in data_value['urls']:
-                                        return data_value['urls']['original'].strip()
-                            
-                            # 处理data为列表的情况
-                            elif isinstance(data_value, list) and data_value:
-                                first_item = data_value[0]
-                                if isinstance(first_item, dict):
-                                    # 检查列表项中的url字段
-                                    if 'url' in first_item:
-                                        return first_item['url'].strip()
-                                    # 检查列表项中的urls字段
-                                    elif 'urls' in first_item and isinstance(first_item['urls'], dict):
-                                        if 'original' in first_item['urls']:
-                                            return first_item['urls']['original'].strip()
-                        
-                        # 处理直接有url字段的情况
-                        elif 'url' in data:
-                            return data.get('url').strip()
-                        
-                        # 处理有image字段的情况
-                        elif 'image' in data:
-                            return data.get('image').strip()
-                        
-                        # 处理有img字段的情况
-                        elif 'img' in data:
-                            return data.get('img').strip()
+                    progress_callback(completed, count, task)
                 except Exception as e:
-                    logger.error(f"解析JSON失败: {str(e)}")
-                    pass
-            
-            # 处理其他情况，检查最终的URL是否是图片URL
-            final_url = response.url
-            if self._is_image_url(final_url):
-                return final_url
+                    logger.error(f"批量进度回调失败: {str(e)}")
+        
+        logger.info(f"开始批量下载: {count} 张，并发数 {concurrency}")
+        await asyncio.gather(*(run_task(task) for task in tasks))
+        
+        dedup_service.flush()
+        success_count = sum(1 for task in tasks if task.status == DownloadStatus.SUCCESS)
+        logger.info(f"批量下载完成: 成功 {success_count}/{count}")
+        return tasks
+    
+    async def _run_batch_task_async(self, task: DownloadTask):
+        """执行单个批量任务：选择API、获取并下载图片，失败时换一个API重试"""
+        task.status = DownloadStatus.DOWNLOADING
+        
+        def on_progress(info):
+            task.progress = info.percent
+            task.total_size = info.total
+            task.speed = info.speed
+        
+        # 优先下载多图API之前返回的其余图片，不必再次请求API
+        with self.lock:
+            harvested = self.harvest_pool.pop(0) if self.harvest_pool else None
+        if harvested:
+            task.api_name = harvested.api_name
+            progress = ProgressAggregator(on_progress)
+            save_path, _ = await self._download_image_async(harvested.image_url, harvested.api_name, progress.update)
+            if save_path:
+                progress.finish()
+                task.url = harvested.image_url
+                task.save_path = save_path
+                task.status = DownloadStatus.SUCCESS
+                return
+        
+        # 每次尝试换一个不同的API，不会因抽到已失败的API而浪费尝试次数
+        api_configs = api_service.sample(self.batch_max_attempts, unique=True)
+        if not api_configs:
+            task.error_message = "没有可用的API"
+        for api_config in api_configs:
+            task.api_name = api_config.name
             
-            if 'text/html' in content_type:
+            progress = ProgressAggregator(on_progress)
+            save_path, image_url = await self._fetch_image_async(api_config, progress.update)
+            if save_path:
+                progress.finish()
+                task.url = image_url
+                task.save_path = save_path
+                task.status = DownloadStatus.SUCCESS
+                task.error_message = ""
+                return
+            task.error_message = f"API {api_config.name} 下载失败"
+        
+        task.status = DownloadStatus.FAILED
+        if not task.error_message:
+            task.error_message = "下载失败"
+    
+    def _commit_staged_item(self, item: PreloadItem, progress_callback=None) -> Optional[str]:
+        """将暂存目录中预下载的图片原子地移动到下载目录"""
+        save_path = None
+        try:
+            save_path = self._reserve_save_path(item.image_url, item.content_type)
+            os.replace(item.staged_path, save_path)
+            if item.content_hash:
+                save_path = self._dedup_saved_file(save_path, item.content_hash, item.image_url)
+            if progress_callback:
+                progress_callback(item.size, item.size)
+            logger.info(f"使用预下载的图片: {save_path}")
+            return save_path
+        except Exception as e:
+            logger.error(f"移动预下载图片失败: {str(e)}")
+            if save_path and os.path.exists(save_path):
                 try:
-                    import re
-                    html_content = response.text()
-                    img_match = re.search(r'<img[^>]+src=["\']([^"\']+)["\']', html_content)
-                    if img_match:
-                        img_url = img_match.group(1)
-                        if not img_url.startswith('http'):
-                            from urllib.parse import urljoin
-                            img_url = urljoin(api_url, img_url)
-                        return img_url
-                except Exception:
+                    os.remove(save_path)
+                except OSError:
                     pass
-            
             return None
+        finally:
+            self._discard_staged_item(item)
+    
+    def _discard_staged_item(self, item: PreloadItem):
+        """释放暂存图片占用的字节预算，并删除尚未移动的暂存文件"""
+        if not item.is_staged:
+            return
+        self._release_staging_bytes(item.size)
+        if os.path.exists(item.staged_path):
+            try:
+                os.remove(item.staged_path)
+            except OSError as e:
+                logger.error(f"删除暂存文件失败: {str(e)}")
+        item.staged_path = None
+    
+    def _reserve_staging_bytes(self, size: int) -> bool:
+        with self.lock:
+            if self.staged_bytes + size > self.staging_max_bytes:
+                return False
+            self.staged_bytes += size
+            return True
+    
+    def _release_staging_bytes(self, size: int):
+        with self.lock:
+            self.staged_bytes = max(0, self.staged_bytes - size)
+    
+    async def _prefetch_async(self, api_config) -> Optional[PreloadItem]:
+        """预加载一张图片：获取图片URL，并在字节预算内把图片内容下载到暂存目录"""
+        try:
+            async with AsyncExitStack() as stack:
+                direct_response = None
+                with metrics.span("resolve", api=api_config.name):
+                    # 重定向型API先只取得图片URL，已下载过的图片不必再传输
+                    resolved = await self._resolve_redirect_async(api_config, self._build_api_url(api_config))
+                    if resolved:
+                        image_url, ttfb = resolved
+                        image_urls = [image_url]
+                    else:
+                        image_urls, ttfb, direct_response = await self._request_prefetch_api_async(api_config, stack)
+                
+                # API直接返回图片时暂存第一次响应的内容，传输不计入resolve
+                if direct_response is not None:
+                    transfer_started = time.monotonic()
+                    preload_item = await self._stage_response_async(direct_response, str(direct_response.url), api_config.name)
+                    self._record_transfer(api_config.name, ttfb, preload_item.size, transfer_started)
+                    return self._drop_duplicate_preload(preload_item)
+            if not image_urls:
+                health_service.record_failure(api_config.name)
+                return None
+            if self.duplicate_mode != 'keep':
+                new_urls = [url for url in image_urls if not dedup_service.find_by_url(url)]
+                if not new_urls:
+                    logger.info(f"图片URL已下载过，不再预加载: {image_urls[0]}")
+                    return None
+                image_urls = new_urls
+            image_url = image_urls[0]
+            self._harvest_urls(api_config.name, image_urls[1:])
+            
+            transfer_started = time.monotonic()
+            async with http_client.async_stream(image_url, timeout=http_client.download_timeout) as response:
+                preload_item = await self._stage_response_async(response, image_url, api_config.name)
+            self._record_transfer(api_config.name, ttfb, preload_item.size, transfer_started)
+            return self._drop_duplicate_preload(preload_item)
         except Exception as e:
-            logger.error(f"获取图片URL失败: {str(e)}")
+            logger.error(f"预下载图片失败: {str(e)}")
+            health_service.record_failure(api_config.name)
             return None
     
-    def _run_async(self, coro):
-        """运行异步函数并返回结果"""
-        import asyncio
+    async def _request_prefetch_api_async(self, api_config, stack: AsyncExitStack) -> tuple[List[str], float, Optional[aiohttp.ClientResponse]]:
+        """按普通方式请求API（支持时一次请求多张图片），返回 (图片URL列表, 首字节时间, 直接返回图片时的响应)
+        
+        API直接返回图片时不读取响应体，响应交给stack管理，由调用方读取图片内容，此时图片URL列表为空
+        """
+        api_url = self._build_api_url(api_config, self.preload_batch_size)
+        batch_requested = api_url != self._build_api_url(api_config)
+        
+        started = time.monotonic()
         try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            # 如果当前线程没有事件循环，创建一个新的
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        return loop.run_until_complete(coro)
-    
-    def _get_image_url(self, api_config) -> Optional[str]:
+            response = await stack.enter_async_context(
+                http_client.async_stream(api_url, timeout=http_client.download_timeout)
+            )
+        except aiohttp.ClientResponseError as e:
+            # 带数量参数的请求返回4xx（限流除外）多半是API不接受该参数，不算作API失败，去掉参数重试一次
+            if not batch_requested or not 400 <= e.status < 500 or e.status == 429:
+                raise
+            self._batch_unsupported.add(api_config.name)
+            logger.info(f"API {api_config.name} 拒绝了批量请求（{e.status}），之后不再附加数量参数")
+            return await self._request_prefetch_api_async(api_config, stack)
+        ttfb = self._observe_ttfb(api_config.name, started)
+        resolution_service.record(api_config.name, resolution_service.classify(response))
+        content_type = response.headers.get('Content-Type', '')
+        final_url = str(response.url)
+        
+        if 'image/' in content_type:
+            if batch_requested:
+                self._batch_unsupported.add(api_config.name)
+            return [], ttfb, response
+        
+        content = await response.read()
+        image_urls = self._extract_image_urls(api_config, content, content_type, final_url, api_url)
+        if batch_requested and len(image_urls) <= 1:
+            # 没有返回图片可能是API不接受数量参数，只返回一张说明不支持批量请求，之后都按普通方式请求
+            self._batch_unsupported.add(api_config.name)
+            logger.info(f"API {api_config.name} 不支持批量请求，之后不再附加数量参数")
+        return image_urls, ttfb, None
+    
+    def _harvest_urls(self, api_name: str, image_urls: List[str]):
+        """保存多图API一次返回的其余图片URL，之后补充预加载池或下载时直接使用"""
+        added = 0
+        with self.lock:
+            known_urls = {item.image_url for item in self.harvest_pool}
+            known_urls.update(item.image_url for item in self.preload_pool)
+            for image_url in image_urls:
+                if len(self.harvest_pool) >= self.harvest_pool_size:
+                    break
+                if image_url in known_urls:
+                    continue
+                if self.duplicate_mode != 'keep' and dedup_service.find_by_url(image_url):
+                    continue
+                known_urls.add(image_url)
+                self.harvest_pool.append(PreloadItem(image_url=image_url, api_name=api_name))
+                added += 1
+        if added:
+            logger.info(f"API {api_name} 返回了多张图片，保存其余 {added} 个图片URL")
+    
+    async def _prefetch_harvested_async(self, item: PreloadItem) -> Optional[PreloadItem]:
+        """把多图API返回的图片下载到暂存目录，不再请求API"""
         try:
-            return self._run_async(self._get_image_url_async(api_config))
+            if self.duplicate_mode != 'keep' and dedup_service.find_by_url(item.image_url):
+                return None
+            async with http_client.async_stream(item.image_url, timeout=http_client.download_timeout) as response:
+                preload_item = await self._stage_response_async(response, item.image_url, item.api_name)
+            return self._drop_duplicate_preload(preload_item)
         except Exception as e:
-            logger.error(f"同步获取图片URL失败: {str(e)}")
+            logger.error(f"预下载图片失败: {str(e)}")
             return None
     
-    async def _download_image_async(self, url: str, api_name: str, progress_callback=None) -> Optional[str]:
+    def _drop_duplicate_preload(self, preload_item: PreloadItem) -> Optional[PreloadItem]:
+        """暂存的图片与已下载的图片内容相同时丢弃，让预加载池只保留新图片"""
+        if self.duplicate_mode == 'keep' or not preload_item.content_hash:
+            return preload_item
+        existing_path = dedup_service.find_by_hash(preload_item.content_hash)
+        if not existing_path:
+            return preload_item
+        logger.info(f"预加载的图片与已下载的 {existing_path} 相同，丢弃")
+        self._discard_staged_item(preload_item)
+        return None
+    
+    async def _stage_response_async(self, response, url: str, api_name: str) -> PreloadItem:
+        """将响应内容写入暂存目录；超出字节预算时放弃内容，只保留图片URL"""
+        content_type = response.headers.get('Content-Type', '')
+        total_size = int(response.headers.get('content-length', 0))
+        url_only_item = PreloadItem(image_url=url, api_name=api_name, content_type=content_type)
+        
+        if not self._reserve_staging_bytes(total_size):
+            logger.info(f"暂存目录空间不足，只预加载图片URL: {url}")
+            return url_only_item
+        
+        reserved_size = total_size
+        downloaded_size = 0
+        hasher = dedup_service.new_hasher()
+        staged_path = os.path.join(self.staging_dir, f"{uuid.uuid4().hex}{self._guess_extension(url, content_type)}")
+        writer = AsyncFileWriter(staged_path, total_size, hasher)
         try:
-            async with aiohttp.ClientSession() as session:
-                session.headers.update({
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36 Edg/144.0.0.0"
-                })
-                async with session.get(url) as response:
-                    response.raise_for_status()
-                    
-                    total_size = int(response.headers.get('content-length', 0))
-                    downloaded_size = 0
-                    
-                    timestamp = time.strftime('%Y%m%d_%H%M%S')
-                    ext = os.path.splitext(url)[1] or '.jpg'
-                    file_name = f"{timestamp}{ext}"
-                    save_path = os.path.join(self.download_dir, file_name)
-                    
-                    if os.path.exists(save_path):
-                        import random
-                        random_suffix = random.randint(1000, 9999)
-                        file_name = f"{timestamp}_{random_suffix}{ext}"
-                        save_path = os.path.join(self.download_dir, file_name)
-                    
-                    with open(save_path, 'wb') as f:
-                        async for chunk in response.content.iter_chunked(8192):
-                            if chunk:
-                                f.write(chunk)
-                                downloaded_size += len(chunk)
-                                
-                                if total_size > 0 and progress_callback:
-                                    progress = int((downloaded_size / total_size) * 100)
-                                    progress_callback(progress, total_size)
-                    
-                    if progress_callback:
-                        progress_callback(100, total_size)
-                    
-                    logger.info(f"图片下载成功: {save_path}")
-                    return save_path
+            await writer.open()
+            async for chunk in response.content.iter_chunked(choose_chunk_size(total_size)):
+                if not chunk:
+                    continue
+                await http_client.throttle_download(len(chunk))
+                downloaded_size += len(chunk)
+                # 未知大小或大小与声明不符时，按实际写入量追加预算
+                if downloaded_size > reserved_size:
+                    if not self._reserve_staging_bytes(downloaded_size - reserved_size):
+                        raise OverflowError("暂存目录空间不足")
+                    reserved_size = downloaded_size
+                await writer.write(chunk)
+            await writer.close()
+        except BaseException as e:
+            await writer.abort()
+            self._release_staging_bytes(reserved_size)
+            try:
+                os.remove(staged_path)
+            except OSError:
+                pass
+            if isinstance(e, OverflowError):
+                logger.info(f"暂存目录空间不足，只预加载图片URL: {url}")
+                return url_only_item
+            raise
+        
+        if reserved_size > downloaded_size:
+            self._release_staging_bytes(reserved_size - downloaded_size)
+        
+        return PreloadItem(
+            image_url=url,
+            api_name=api_name,
+            staged_path=staged_path,
+            size=downloaded_size,
+            content_type=content_type,
+            content_hash=hasher.hexdigest()
+        )
+    
+    def start_prefetch(self):
+        """启动或唤醒后台预加载调度任务，不阻塞调用线程"""
+        try:
+            http_client.submit(self._wake_prefetch_async())
         except Exception as e:
-            logger.error(f"下载图片失败: {str(e)}")
-            return None
+            logger.error(f"启动预加载调度任务失败: {str(e)}")
     
-    def _download_image(self, url: str, api_name: str, progress_callback=None) -> Optional[str]:
+    def reset_prefetch(self):
+        """取消正在进行的预加载并清空预加载池和API缓存池，用于API来源或配置变化时"""
         try:
-            return self._run_async(self._download_image_async(url, api_name, progress_callback))
+            self._run_async(self._cancel_prefetch_async())
         except Exception as e:
-            logger.error(f"同步下载图片失败: {str(e)}")
-            return None
+            logger.error(f"取消预加载调度任务失败: {str(e)}")
+        self.clear_preload_pool()
+        with self.lock:
+            self.api_cache_pool.clear()
+        logger.info("预加载池和API缓存池已清空")
+    
+    async def _wake_prefetch_async(self):
+        if self._prefetch_task is None or self._prefetch_task.done():
+            self._prefetch_wakeup = asyncio.Event()
+            self._prefetch_task = asyncio.ensure_future(self._prefetch_loop())
+        self._prefetch_wakeup.set()
     
-    def _preload_images(self):
+    async def _cancel_prefetch_async(self):
+        task = self._prefetch_task
+        self._prefetch_task = None
+        if task and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    
+    async def _prefetch_loop(self):
+        """常驻的预加载调度任务：被唤醒后检查水位，低于低水位时补充到高水位"""
+        logger.info("预加载调度任务已启动")
+        backoff = 0
         try:
-            # 限制预加载的最大尝试次数，避免无限循环
-            max_attempts = 5
+            while True:
+                if backoff:
+                    # 上次补充没有任何进展，等待一段时间后再重试，期间被唤醒则立即重试
+                    try:
+                        await asyncio.wait_for(self._prefetch_wakeup.wait(), timeout=backoff)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self._prefetch_wakeup.wait()
+                self._prefetch_wakeup.clear()
+                
+                if not self._needs_refill():
+                    backoff = 0
+                    continue
+                
+                with metrics.span("preload_refill") as span:
+                    progressed = await self._refill_async()
+                    if not progressed:
+                        span.status = "failed"
+                if progressed:
+                    backoff = 0
+                else:
+                    backoff = min(max(backoff * 2, 1), self.prefetch_max_backoff)
+                    logger.warning(f"预加载没有进展，{backoff} 秒后重试")
+        except asyncio.CancelledError:
+            logger.info("预加载调度任务已取消")
+            raise
+    
+    def _needs_refill(self) -> bool:
+        with self.lock:
+            return (len(self.preload_pool) <= self.preload_low_watermark
+                    or len(self.api_cache_pool) <= self.api_cache_low_watermark)
+    
+    async def _refill_async(self) -> bool:
+        """补充API缓存池和预加载池直到高水位，返回预加载池是否有增长或已满"""
+        # 限制每轮预加载的最大尝试次数，避免无限循环
+        max_attempts = 5
+        with self.lock:
+            initial_size = len(self.preload_pool)
+        
+        # 首先填充API缓存池，确保有足够的随机API名称
+        self._fill_api_cache_pool()
+        
+        while True:
+            with self.lock:
+                size_before = len(self.preload_pool)
+                if size_before >= self.preload_size:
+                    break
+                has_harvested = bool(self.harvest_pool)
+                if not has_harvested and not self.api_cache_pool:
+                    break
             
-            # 首先填充API缓存池，确保有足够的随机API名称
-            self._fill_api_cache_pool(max_attempts)
+            if has_harvested:
+                # 优先暂存多图API已返回的图片，每轮都会取走图片URL，失败时继续下一轮
+                await self._preload_from_harvest_pool_async()
+                continue
             
-            # 然后从API缓存池中取出API名称，使用它们来获取图片URL
-            self._preload_from_cache_pool(max_attempts)
+            # 然后从API缓存池中取出API名称，使用它们来预下载图片
+            await self._preload_from_cache_pool_async(max_attempts)
             
-            # 当图片链接缓存到缓存池后，继续缓存随机API名直到达到缓存大小
-            self._fill_api_cache_pool(max_attempts)
-        except Exception as e:
-            logger.error(f"预加载失败: {str(e)}")
+            # 当图片缓存到预加载池后，继续缓存随机API名直到达到缓存大小
+            self._fill_api_cache_pool()
+            
+            with self.lock:
+                if len(self.preload_pool) <= size_before:
+                    break
+        
+        with self.lock:
+            return len(self.preload_pool) > initial_size or len(self.preload_pool) >= self.preload_size
     
-    def _fill_api_cache_pool(self, max_attempts):
+    def _fill_api_cache_pool(self):
         """填充API缓存池"""
-        attempt_count = 0
-        while attempt_count < max_attempts:
-            try:
+        try:
+            with self.lock:
+                needed = self.api_cache_size - len(self.api_cache_pool)
+                cached_names = set(self.api_cache_pool)
+            if needed <= 0:
+                return
+            
+            # 多取出与缓存池中已有数量相同的API，抵消与已有API重复的部分
+            for api_config in api_service.sample(needed + len(cached_names), unique=True):
                 with self.lock:
                     if len(self.api_cache_pool) >= self.api_cache_size:
                         break
-                
-                api_config = api_service.get_random_api()
-                if not api_config:
-                    time.sleep(0.1)
-                    attempt_count += 1
-                    continue
-                
-                with self.lock:
-                    if api_config.name not in self.api_cache_pool and len(self.api_cache_pool) < self.api_cache_size:
+                    if api_config.name not in self.api_cache_pool:
                         self.api_cache_pool.append(api_config.name)
                         logger.info(f"添加API到缓存池: {api_config.name}")
+        except Exception as e:
+            logger.error(f"填充API缓存池失败: {str(e)}")
+    
+    async def _preload_from_cache_pool_async(self, max_attempts):
+        """并发使用API缓存池中的API预加载图片，预加载池填满后取消其余请求"""
+        with self.lock:
+            if len(self.preload_pool) >= self.preload_size:
+                return
+            api_names = self.api_cache_pool[:max_attempts]
+            del self.api_cache_pool[:max_attempts]
+        
+        api_configs = []
+        for api_name in api_names:
+            api_config = api_service.get_api_by_name(api_name)
+            if api_config:
+                api_configs.append(api_config)
+        if not api_configs:
+            return
+        
+        semaphore = asyncio.Semaphore(self.preload_concurrency)
+        
+        async def prefetch(api_config):
+            async with semaphore:
+                return api_config, await self._prefetch_async(api_config)
+        
+        pending = {asyncio.ensure_future(prefetch(api_config)) for api_config in api_configs}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        api_config, preload_item = task.result()
+                    except Exception as e:
+                        logger.error(f"从缓存池预加载失败: {str(e)}")
+                        continue
+                    metrics.inc("prefetch_total", api=api_config.name, status="ok" if preload_item else "failed")
+                    if preload_item:
+                        self._add_preload_item(preload_item)
+                    else:
+                        logger.warning(f"API {api_config.name} 获取图片失败，尝试其他API")
                 
-                attempt_count += 1
-            except Exception as e:
-                logger.error(f"填充API缓存池失败: {str(e)}")
-                attempt_count += 1
-                time.sleep(0.1)
-    
-    def _preload_from_cache_pool(self, max_attempts):
-        """从API缓存池中预加载图片"""
-        attempt_count = 0
-        while attempt_count < max_attempts:
-            try:
                 with self.lock:
                     if len(self.preload_pool) >= self.preload_size:
                         break
-                    if not self.api_cache_pool:
-                        break
-                
-                # 从API缓存池中取出一个API名称
-                api_name = None
-                with self.lock:
-                    if self.api_cache_pool:
-                        api_name = self.api_cache_pool.pop(0)
-                
-                if not api_name:
-                    attempt_count += 1
-                    continue
-                
-                api_config = api_service.get_api_by_name(api_name)
-                if not api_config:
-                    attempt_count += 1
-                    continue
-                
-                # 尝试使用这个API获取图片URL
-                image_url = self._get_image_url(api_config)
-                if image_url:
-                    preload_item = (image_url, api_config.name)
-                    with self.lock:
-                        if preload_item not in self.preload_pool and len(self.preload_pool) < self.preload_size:
-                            self.preload_pool.append(preload_item)
-                            logger.info(f"预加载图片: {image_url} (来自 {api_config.name})")
-                else:
-                    # 如果获取失败，尝试其他API
-                    logger.warning(f"API {api_name} 获取图片失败，尝试其他API")
-                
-                attempt_count += 1
-            except Exception as e:
-                logger.error(f"从缓存池预加载失败: {str(e)}")
-                attempt_count += 1
-                time.sleep(0.1)
+        finally:
+            # 预加载池已满，取消仍在进行的慢请求
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.info(f"预加载池已满，取消 {len(pending)} 个未完成的预加载请求")
+                await asyncio.gather(*pending, return_exceptions=True)
     
-    def _is_image_url(self, url: str) -> bool:
-        image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
-        return any(ext in url.lower() for ext in image_extensions)
+    async def _preload_from_harvest_pool_async(self):
+        """并发暂存多图API返回的图片，数量不超过预加载池的空位"""
+        with self.lock:
+            needed = min(self.preload_size - len(self.preload_pool), self.preload_concurrency)
+            items = self.harvest_pool[:max(needed, 0)]
+            del self.harvest_pool[:len(items)]
+        if not items:
+            return
+        results = await asyncio.gather(*(self._prefetch_harvested_async(item) for item in items))
+        for preload_item in results:
+            if preload_item:
+                self._add_preload_item(preload_item)
+    
+    def _add_preload_item(self, preload_item: PreloadItem) -> bool:
+        """将预加载的图片加入预加载池，池已满或图片重复时丢弃"""
+        with self.lock:
+            if preload_item.is_staged:
+                is_duplicate = any(item.content_hash == preload_item.content_hash for item in self.preload_pool)
+            else:
+                is_duplicate = any(item.image_url == preload_item.image_url for item in self.preload_pool)
+            if not is_duplicate and len(self.preload_pool) < self.preload_size:
+                self.preload_pool.append(preload_item)
+                if preload_item.is_staged:
+                    logger.info(f"预下载图片: {preload_item.image_url} ({preload_item.size} 字节，来自 {preload_item.api_name})")
+                else:
+                    logger.info(f"预加载图片: {preload_item.image_url} (来自 {preload_item.api_name})")
+                return True
+        self._discard_staged_item(preload_item)
+        return False
     
     def get_status(self) -> Optional[DownloadStatus]:
         with self.lock:
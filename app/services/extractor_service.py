@@ -0,0 +1,257 @@
+import re
+import json
+import threading
+from typing import Optional, List
+from urllib.parse import urljoin
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
+
+_JSON_PATH_TOKEN = re.compile(r'\.?([^.\[\]]+)|\[(\d+|\*)\]')
+_HTML_IMG_PATTERN = r'<img[^>]+src=["\']([^"\']+)["\']'
+_NO_JSON = object()
+
+def is_image_url(url: str) -> bool:
+    url = url.lower()
+    return any(ext in url for ext in IMAGE_EXTENSIONS)
+
+class ResponseContent:
+    """一次API响应的内容，JSON和文本只在第一次需要时解析，供多个提取规则共用"""
+    def __init__(self, content: bytes, content_type: str, final_url: str, api_url: str):
+        self.content = content
+        self.content_type = content_type.lower()
+        self.final_url = final_url
+        self.api_url = api_url
+        self._json = None
+        self._text = None
+    
+    @property
+    def json(self):
+        """解析后的JSON，不是JSON时为None；内容类型不是JSON但内容以 { 或 [ 开头时也尝试解析"""
+        if self._json is None:
+            self._json = _NO_JSON
+            looks_like_json = 'json' in self.content_type or self.content[:64].lstrip()[:1] in (b'{', b'[')
+            if looks_like_json:
+                try:
+                    # json.loads可以直接解析bytes，无需先解码
+                    self._json = json.loads(self.content)
+                except ValueError as e:
+                    if 'json' in self.content_type:
+                        logger.error(f"解析JSON失败: {str(e)}")
+        return None if self._json is _NO_JSON else self._json
+    
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.content.decode('utf-8', errors='replace')
+        return self._text
+
+class Extractor:
+    """从API响应中提取图片URL的规则，返回候选URL；只有展开JSON列表或多次匹配的规则会返回多个"""
+    spec = ""
+    yields_list = False  # 规则是否会得到并列的多张图片（展开JSON列表或正则多次匹配）
+    
+    def extract(self, response: ResponseContent) -> List[str]:
+        raise NotImplementedError
+    
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.spec}>"
+
+class JsonPathExtractor(Extractor):
+    """按键路径提取JSON中的字符串，如 data[*].urls.original、$.data[0].url
+    
+    [*] 匹配列表的所有元素；用在对象上时依次尝试对象的各个值，只取第一个是地址的结果
+    """
+    def __init__(self, path: str):
+        self.spec = f"json:{path}"
+        self.steps = self.compile_path(path)
+        self.yields_list = Ellipsis in self.steps
+    
+    @staticmethod
+    def compile_path(path: str) -> list:
+        path = path.strip()
+        if path.startswith('$'):
+            path = path[1:]
+        steps = []
+        pos = 0
+        while pos < len(path):
+            match = _JSON_PATH_TOKEN.match(path, pos)
+            if not match or match.end() == pos:
+                raise ValueError(f"无效的JSON路径: {path}")
+            key, index = match.groups()
+            if key is not None:
+                steps.append(key.strip())
+            elif index == '*':
+                steps.append(Ellipsis)  # 通配符
+            else:
+                steps.append(int(index))
+            pos = match.end()
+        if not steps:
+            raise ValueError("JSON路径为空")
+        return steps
+    
+    def extract(self, response: ResponseContent) -> List[str]:
+        data = response.json
+        if data is None:
+            return []
+        nodes = [data]
+        single = False  # 对象的各个值（如缩略图和原图）不是并列的多张图片
+        for step in self.steps:
+            next_nodes = []
+            for node in nodes:
+                if step is Ellipsis:
+                    if isinstance(node, list):
+                        next_nodes.extend(node)
+                    elif isinstance(node, dict):
+                        next_nodes.extend(node.values())
+                        single = True
+                elif isinstance(step, int):
+                    if isinstance(node, list) and -len(node) <= step < len(node):
+                        next_nodes.append(node[step])
+                elif isinstance(node, dict) and step in node:
+                    next_nodes.append(node[step])
+            nodes = next_nodes
+            if not nodes:
+                return []
+        # 只接受看起来是地址的字符串，避免把 {"data": "ok"} 之类的消息当作图片URL
+        urls = [node.strip() for node in nodes if isinstance(node, str)]
+        urls = [url if url.startswith('http') else urljoin(response.api_url, url)
+                for url in urls if url.startswith(('http://', 'https://', '//', '/'))]
+        return urls[:1] if single else urls
+
+class RegexExtractor(Extractor):
+    """用正则表达式从响应文本中提取URL，有捕获组时取第一个捕获组；相对地址按API地址补全"""
+    def __init__(self, pattern: str, content_type_hint: str = "", multiple: bool = True):
+        self.spec = f"re:{pattern}"
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+        self.content_type_hint = content_type_hint  # 非空时只处理内容类型包含该字符串的响应
+        self.multiple = multiple  # 为False时只取第一个匹配
+        self.yields_list = multiple
+    
+    def extract(self, response: ResponseContent) -> List[str]:
+        if self.content_type_hint and self.content_type_hint not in response.content_type:
+            return []
+        urls = []
+        for match in self.pattern.finditer(response.text):
+            url = (match.group(1) if self.pattern.groups else match.group(0)).strip()
+            if not url:
+                continue
+            urls.append(url if url.startswith('http') else urljoin(response.api_url, url))
+            if not self.multiple:
+                break
+        return urls
+
+class FinalUrlExtractor(Extractor):
+    """API重定向到图片地址时，响应的最终URL就是图片URL"""
+    spec = "final_url"
+    
+    def extract(self, response: ResponseContent) -> List[str]:
+        return [response.final_url] if is_image_url(response.final_url) else []
+
+# 自动识别时依次尝试的规则，顺序与原先硬编码的判断顺序一致
+AUTO_DETECT_EXTRACTORS = [
+    JsonPathExtractor('data'),
+    JsonPathExtractor('data.url'),
+    JsonPathExtractor('data.urls.original'),
+    JsonPathExtractor('data[*].url'),
+    JsonPathExtractor('data[*].urls.original'),
+    JsonPathExtractor('data[*]'),
+    JsonPathExtractor('url'),
+    JsonPathExtractor('image'),
+    JsonPathExtractor('img'),
+    FinalUrlExtractor(),
+    # 网页中的其他<img>多为图标、logo或统计像素，只取第一个
+    RegexExtractor(_HTML_IMG_PATTERN, content_type_hint='text/html', multiple=False),
+]
+
+class ExtractorService:
+    """解析API响应中的图片URL
+    
+    apis.txt中为API声明的提取规则（<json:路径> 或 <re:正则>）在解析列表时编译一次；
+    未声明规则的API依次尝试AUTO_DETECT_EXTRACTORS，第一次成功的规则按API缓存，之后直接使用
+    """
+    def __init__(self):
+        self._compiled = {}  # 规则字符串 -> Extractor，编译失败时为None
+        self._detected = {}  # API名称 -> 自动识别出的Extractor
+        self.lock = threading.Lock()
+    
+    def compile(self, spec: str) -> Optional[Extractor]:
+        """编译提取规则，规则无效时记录警告并返回None"""
+        if not spec:
+            return None
+        with self.lock:
+            if spec in self._compiled:
+                return self._compiled[spec]
+        extractor = None
+        try:
+            kind, _, body = spec.partition(':')
+            kind = kind.strip().lower()
+            if kind == 'json':
+                extractor = JsonPathExtractor(body)
+            elif kind == 're':
+                extractor = RegexExtractor(body)
+            else:
+                raise ValueError(f"未知的提取规则类型: {kind}")
+        except (ValueError, re.error) as e:
+            logger.warning(f"无效的提取规则 <{spec}>: {str(e)}")
+        with self.lock:
+            self._compiled[spec] = extractor
+        return extractor
+    
+    def extract(self, api_config, content: bytes, content_type: str, final_url: str, api_url: str) -> List[str]:
+        """返回响应中的候选图片URL（按出现顺序去重），没有找到时返回空列表
+        
+        只有结果来自得到并列多张图片的规则（yields_list）时才返回多个URL，其余规则只返回第一个，
+        因此调用方可以把第一个之后的URL当作同一次响应返回的其他图片
+        """
+        response = ResponseContent(content, content_type, final_url, api_url)
+        
+        declared = self.compile(api_config.extractor)
+        if declared is not None:
+            urls = declared.extract(response)
+            if urls:
+                return self._result(declared, urls)
+            logger.warning(f"API {api_config.name} 的提取规则 <{declared.spec}> 没有匹配到图片URL，尝试自动识别")
+        
+        with self.lock:
+            detected = self._detected.get(api_config.name)
+        if detected is not None:
+            urls = detected.extract(response)
+            if urls:
+                return self._result(detected, urls)
+        
+        for extractor in AUTO_DETECT_EXTRACTORS:
+            if extractor is detected:
+                continue
+            urls = extractor.extract(response)
+            if urls:
+                with self.lock:
+                    self._detected[api_config.name] = extractor
+                logger.info(f"API {api_config.name} 使用提取规则: {extractor.spec}")
+                return self._result(extractor, urls)
+        return []
+    
+    @staticmethod
+    def _result(extractor: Extractor, urls: List[str]) -> List[str]:
+        if not extractor.yields_list:
+            return urls[:1]
+        return list(dict.fromkeys(urls))
+    
+    def get_detected(self, api_name: str) -> Optional[str]:
+        with self.lock:
+            extractor = self._detected.get(api_name)
+        return extractor.spec if extractor else None
+    
+    def forget(self, api_name: Optional[str] = None):
+        """清除自动识别的缓存（API地址变化时调用）"""
+        with self.lock:
+            if api_name is None:
+                self._detected.clear()
+            else:
+                self._detected.pop(api_name, None)
+
+# 导出默认提取服务实例
+extractor_service = ExtractorService()
@@ -0,0 +1,124 @@
+import time
+import threading
+from typing import Dict, List, Optional
+
+from app.models.api import ApiConfig, ApiHealth
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class HealthService:
+    """记录每个API的成功率、首字节时间和下载速度，并对连续失败的API进行指数退避隔离（熔断）"""
+    def __init__(self, alpha: float = 0.3, failure_threshold: int = 2,
+                 base_quarantine: float = 5.0, max_quarantine: float = 300.0,
+                 reference_ttfb: float = 1.0, reference_throughput: float = 1024 * 1024,
+                 score_tolerance: float = 0.2):
+        self.alpha = alpha  # 滑动平均中新样本的权重
+        self.failure_threshold = failure_threshold  # 连续失败达到该次数后开始隔离
+        self.base_quarantine = base_quarantine
+        self.max_quarantine = max_quarantine
+        self.reference_ttfb = reference_ttfb
+        self.reference_throughput = reference_throughput
+        self.score_tolerance = score_tolerance  # 健康系数相对上次发布的值变化超过该比例才算明显变化
+        self.stats: Dict[str, ApiHealth] = {}
+        # 选择表据此判断是否需要重建：API进入或解除隔离时version递增，需要立即重建；
+        # 健康系数明显变化时score_version递增，选择表可以限制重建频率；其余样本不改变两者
+        self.version = 0
+        self.score_version = 0
+        self._published_scores: Dict[str, float] = {}  # 上次计入score_version时的健康系数
+        self.lock = threading.Lock()
+    
+    def _get_stats(self, api_name: str) -> ApiHealth:
+        stats = self.stats.get(api_name)
+        if stats is None:
+            stats = self.stats[api_name] = ApiHealth()
+        return stats
+    
+    def _publish_score(self, api_name: str):
+        """健康系数相对上次发布的值明显变化时递增score_version，调用方需持有锁"""
+        score = self.score(api_name)
+        published = self._published_scores.get(api_name, 1.0)
+        if abs(score - published) > self.score_tolerance * published:
+            self._published_scores[api_name] = score
+            self.score_version += 1
+    
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        if current is None:
+            return sample
+        return current + self.alpha * (sample - current)
+    
+    def record_success(self, api_name: str, ttfb: Optional[float] = None,
+                       size: int = 0, transfer_time: Optional[float] = None):
+        with self.lock:
+            stats = self._get_stats(api_name)
+            stats.success_rate = self._ewma(stats.success_rate, 1.0)
+            if ttfb is not None:
+                stats.ttfb = self._ewma(stats.ttfb, ttfb)
+            if size > 0 and transfer_time:
+                stats.throughput = self._ewma(stats.throughput, size / transfer_time)
+            if stats.quarantined_until:
+                logger.info(f"API {api_name} 恢复正常，解除隔离")
+                self.version += 1
+            stats.consecutive_failures = 0
+            stats.quarantined_until = 0.0
+            stats.total_successes += 1
+            self._publish_score(api_name)
+    
+    def record_failure(self, api_name: str):
+        with self.lock:
+            stats = self._get_stats(api_name)
+            stats.success_rate = self._ewma(stats.success_rate, 0.0)
+            stats.consecutive_failures += 1
+            stats.total_failures += 1
+            if stats.consecutive_failures >= self.failure_threshold:
+                # 隔离时间随连续失败次数指数增长
+                exponent = stats.consecutive_failures - self.failure_threshold
+                duration = min(self.base_quarantine * (2 ** exponent), self.max_quarantine)
+                now = time.monotonic()
+                if stats.quarantined_until <= now:
+                    self.version += 1
+                stats.quarantined_until = now + duration
+                logger.warning(f"API {api_name} 连续失败 {stats.consecutive_failures} 次，隔离 {duration:.0f} 秒")
+            self._publish_score(api_name)
+    
+    def is_quarantined(self, api_name: str, now: Optional[float] = None) -> bool:
+        stats = self.stats.get(api_name)
+        if stats is None:
+            return False
+        return stats.quarantined_until > (now if now is not None else time.monotonic())
+    
+    def quarantine_expiry(self, api_name: str) -> float:
+        stats = self.stats.get(api_name)
+        return stats.quarantined_until if stats else 0.0
+    
+    def score(self, api_name: str) -> float:
+        """返回API的健康系数，用于乘以静态权重；未知的API系数为1"""
+        stats = self.stats.get(api_name)
+        if stats is None:
+            return 1.0
+        
+        factor = max(stats.success_rate, 0.05)
+        if stats.ttfb is not None:
+            # 首字节时间等于参考值时系数为1，越快越接近2，越慢越接近0
+            factor *= 2 * self.reference_ttfb / (self.reference_ttfb + stats.ttfb)
+        if stats.throughput is not None:
+            factor *= 2 * stats.throughput / (stats.throughput + self.reference_throughput)
+        return max(factor, 0.01)
+    
+    def rank(self, apis: List[ApiConfig]) -> List[ApiConfig]:
+        """按健康状态排序：未隔离的API按健康系数从高到低，隔离中的API排在最后"""
+        now = time.monotonic()
+        return sorted(apis, key=lambda api: (self.is_quarantined(api.name, now), -self.score(api.name)))
+    
+    def get_stats(self, api_name: str) -> Optional[ApiHealth]:
+        return self.stats.get(api_name)
+    
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self._published_scores.clear()
+            self.version += 1
+            self.score_version += 1
+
+# 导出默认健康状态服务实例
+health_service = HealthService()
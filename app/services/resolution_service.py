@@ -0,0 +1,82 @@
+import time
+import threading
+from typing import Dict, Optional
+
+from app.models.api import ResolutionKind, ResolutionProfile
+from app.services.extractor_service import is_image_url
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+class ResolutionService:
+    """按API缓存响应方式（解析档案）：重定向、JSON、网页或直接返回图片
+    
+    档案在ttl秒内有效，下载服务据此选择代价最小的请求方式：重定向型API不跟随重定向，
+    只读取Location响应头得到图片URL；快速路径的结果与档案不符时档案立即失效，改用普通请求
+    """
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+        self.profiles: Dict[str, ResolutionProfile] = {}
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def classify(response) -> ResolutionKind:
+        """根据跟随重定向后的响应判断API的响应方式"""
+        content_type = response.headers.get('Content-Type', '').lower()
+        final_url = str(response.url)
+        if response.history and ('image/' in content_type or is_image_url(final_url)):
+            return ResolutionKind.REDIRECT
+        if 'image/' in content_type:
+            return ResolutionKind.DIRECT
+        if 'html' in content_type:
+            return ResolutionKind.HTML
+        return ResolutionKind.JSON
+    
+    def get(self, api_name: str) -> Optional[ResolutionKind]:
+        """返回未过期的档案，并计入一次使用"""
+        with self.lock:
+            profile = self.profiles.get(api_name)
+            if profile is None:
+                return None
+            if time.monotonic() >= profile.expires_at:
+                del self.profiles[api_name]
+                return None
+            profile.hits += 1
+            return profile.kind
+    
+    def record(self, api_name: str, kind: ResolutionKind):
+        """记录一次普通请求观察到的响应方式；方式不变时只延长有效期"""
+        with self.lock:
+            profile = self.profiles.get(api_name)
+            expires_at = time.monotonic() + self.ttl
+            if profile is not None and profile.kind == kind:
+                profile.expires_at = expires_at
+                return
+            self.profiles[api_name] = ResolutionProfile(kind=kind, expires_at=expires_at)
+        logger.info(f"API {api_name} 的响应方式: {kind.value}")
+    
+    def invalidate(self, api_name: str):
+        """快速路径的结果与档案不符时调用，下次改用普通请求重新识别"""
+        with self.lock:
+            profile = self.profiles.pop(api_name, None)
+        if profile is not None:
+            logger.info(f"API {api_name} 的响应方式已变化，重新识别")
+    
+    def forget(self, api_name: Optional[str] = None):
+        """清除档案（API地址变化时调用）"""
+        with self.lock:
+            if api_name is None:
+                self.profiles.clear()
+            else:
+                self.profiles.pop(api_name, None)
+    
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            return {name: profile.to_dict() for name, profile in self.profiles.items()
+                    if profile.expires_at > now}
+
+# 导出默认解析档案服务实例
+resolution_service = ResolutionService()
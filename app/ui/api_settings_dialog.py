@@ -109,12 +109,9 @@ class ApiSettingsDialog(QDialog):
             config_service.save_api_configs(apis)
             logger.info("API配置保存成功")
             
-            # 清空预加载池和API缓存池，确保下次下载使用新的API参数
+            # 取消预加载并清空预加载池和API缓存池，确保下次下载使用新的API参数
             from app.services.download_service import download_service
-            with download_service.lock:
-                download_service.preload_pool.clear()
-                download_service.api_cache_pool.clear()
-            logger.info("预加载池和API缓存池已清空")
+            download_service.reset_prefetch()
             
             # 重新加载API配置到api_service中，确保使用最新的配置
             source = config_service.get_api_source()
@@ -122,6 +119,7 @@ class ApiSettingsDialog(QDialog):
             api_service.apis = config_service.load_api_configs(api_service.apis)
             api_service.recalculate_weights()
             logger.info("API配置重新加载成功")
+            download_service.start_prefetch()
             
             # 计算启用的API数量并通知主窗口更新
             enabled_count = sum(1 for api in api_service.get_apis() if api.enabled)
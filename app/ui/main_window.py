@@ -7,9 +7,13 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QFont
 
+from app.network.http_client import http_client
 from app.services.api_service import api_service
 from app.services.download_service import download_service
 from app.services.config_service import config_service
+from app.services.dedup_service import dedup_service
+from app.utils.progress import format_speed, format_eta
+from app.utils.metrics import metrics
 from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -37,6 +41,12 @@ class MainWindow(QMainWindow):
         
         self._create_ui()
         self._load_config()
+        api_service.add_change_listener(self._on_apis_reloaded)
+        api_service.start_watching()
+        http_client.rate_limiter.set_requests_per_host(config_service.get_requests_per_host())
+        metrics_port = config_service.get_metrics_port()
+        if metrics_port:
+            metrics.start_http_server(metrics_port)
         self._init_api_load()
     
     def _load_config(self):
@@ -176,18 +186,10 @@ class MainWindow(QMainWindow):
                 # 保存重新计算的权重
                 config_service.save_api_configs(apis)
                 
-                enabled_count = sum(1 for api in apis if api.enabled)
-                total_count = len(apis)
-                api_info_text = f"已加载 {total_count} 个API，启用 {enabled_count} 个"
-                if source == "local":
-                    api_info_text += f"，配置文件: apis.txt"
-                else:
-                    api_info_text += "，从推荐API获取"
-                
-                self.update_api_info.emit(api_info_text)
+                self.update_api_info.emit(self._format_api_info(apis, source))
                 self._start_preload()
                 self.update_status.emit("点击按钮开始下载")
-                
+            
             except Exception as e:
                 logger.error(f"初始化加载API失败: {str(e)}")
                 self.update_status.emit("加载API失败")
@@ -196,17 +198,39 @@ class MainWindow(QMainWindow):
         init_thread.daemon = True
         init_thread.start()
     
+    def _format_api_info(self, apis, source):
+        enabled_count = sum(1 for api in apis if api.enabled)
+        total_count = len(apis)
+        api_info_text = f"已加载 {total_count} 个API，启用 {enabled_count} 个"
+        if source == "local":
+            api_info_text += f"，配置文件: apis.txt"
+        else:
+            api_info_text += "，从推荐API获取"
+        return api_info_text
+    
+    def _on_apis_reloaded(self, source, diff=None):
+        """API列表在后台被替换或增量更新后重新应用保存的配置，在后台线程中调用"""
+        try:
+            if source != config_service.get_api_source():
+                return
+            config_service.load_api_configs(api_service.get_apis())
+            apis = api_service.recalculate_weights()
+            if diff is None:
+                # 整个列表被替换，预加载池中的图片可能来自已被移除的API，重新预加载
+                download_service.reset_prefetch()
+            else:
+                # 增量更新时只丢弃来自被移除或被修改的API的预加载结果
+                download_service.invalidate_apis(diff.removed + diff.changed)
+            self.update_api_info.emit(self._format_api_info(apis, source))
+            self._start_preload()
+        except Exception as e:
+            logger.error(f"更新API列表失败: {str(e)}")
+    
     def _start_preload(self):
-        def preload_task():
-            try:
-                download_service._preload_images()
-                logger.info("预加载完成")
-            except Exception as e:
-                logger.error(f"预加载失败: {str(e)}")
-        
-        preload_thread = threading.Thread(target=preload_task)
-        preload_thread.daemon = True
-        preload_thread.start()
+        try:
+            download_service.start_prefetch()
+        except Exception as e:
+            logger.error(f"启动预加载失败: {str(e)}")
     
     def _start_download(self):
         if self.download_button.text() == "下载中...":
@@ -218,6 +242,7 @@ class MainWindow(QMainWindow):
             try:
                 animation_running = True
                 current_display_api = "正在选择API..."
+                current_progress = None
                 
                 self.show_progress.emit(True)
                 self.update_progress.emit(0)
@@ -228,15 +253,19 @@ class MainWindow(QMainWindow):
                         try:
                             dots = (dots + 1) % 4
                             animation_text = f"正在从 {current_display_api} 下载{'.' * dots}"
+                            if current_progress and current_progress.speed > 0:
+                                animation_text += f"  {format_speed(current_progress.speed)}，剩余 {format_eta(current_progress.eta)}"
                             self.update_status.emit(animation_text)
                             time.sleep(0.5)
                         except Exception as e:
                             logger.error(f"下载动画失败: {str(e)}")
                             break
                 
-                def progress_callback(progress, total_size):
+                def progress_callback(info):
+                    nonlocal current_progress
                     try:
-                        self.update_progress.emit(progress)
+                        current_progress = info
+                        self.update_progress.emit(info.percent)
                     except Exception as e:
                         logger.error(f"进度回调失败: {str(e)}")
                         pass
@@ -259,7 +288,7 @@ class MainWindow(QMainWindow):
                     self.update_status.emit("下载失败")
                 
                 self.show_progress.emit(False)
-                    
+            
             except Exception as e:
                 logger.error(f"下载失败: {str(e)}")
                 self.update_status.emit("下载失败")
@@ -282,6 +311,8 @@ class MainWindow(QMainWindow):
         
         def load_api_task():
             try:
+                # 取消旧来源的预加载，避免继续使用旧来源的API
+                download_service.reset_prefetch()
                 apis = api_service.load_apis(new_source)
                 apis = config_service.load_api_configs(apis)
                 # 重新计算API权重
@@ -289,18 +320,10 @@ class MainWindow(QMainWindow):
                 # 保存重新计算的权重
                 config_service.save_api_configs(apis)
                 
-                enabled_count = sum(1 for api in apis if api.enabled)
-                total_count = len(apis)
-                api_info_text = f"已加载 {total_count} 个API，启用 {enabled_count} 个"
-                if new_source == "local":
-                    api_info_text += f"，配置文件: apis.txt"
-                else:
-                    api_info_text += "，从推荐API获取"
-                
-                self.update_api_info.emit(api_info_text)
+                self.update_api_info.emit(self._format_api_info(apis, new_source))
                 self.update_status.emit("点击按钮开始下载")
                 self._start_preload()
-                
+            
             except Exception as e:
                 logger.error(f"加载API失败: {str(e)}")
                 self.update_status.emit("加载API失败")
@@ -317,6 +340,9 @@ class MainWindow(QMainWindow):
     def closeEvent(self, event):
         try:
             self.is_closing = True
+            api_service.stop_watching()
+            dedup_service.flush()
+            metrics.stop_http_server()
             
             window_geometry = self.saveGeometry()
             if window_geometry:
@@ -324,7 +350,7 @@ class MainWindow(QMainWindow):
             
             apis = api_service.get_apis()
             config_service.save_api_configs(apis)
-            
+        
         except Exception as e:
             logger.error(f"保存配置失败: {str(e)}")
         
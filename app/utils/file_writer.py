@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import concurrent.futures
+from typing import Optional
+
+from app.utils.logger import get_logger
+from app.utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# 所有下载共享的磁盘写入线程池，线程数有限，避免大量并发下载时创建过多线程
+_io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="file-writer")
+
+def choose_chunk_size(total_size: int) -> int:
+    """根据Content-Length选择每次从网络读取的块大小：小图片用小块，大图片用大块减少事件循环轮次"""
+    if total_size <= 0:
+        return MIN_CHUNK_SIZE
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, total_size // 16))
+
+class AsyncFileWriter:
+    """在线程池中写入文件（并可同时计算哈希）的写入器，不阻塞事件循环
+    
+    数据先在内存中合并到buffer_size，再交给写入线程；同一时间最多只有一次写入在进行，
+    网络读取与磁盘写入并行，写入跟不上时write()会等待，起到有界队列的作用
+    """
+    def __init__(self, path: str, size: int = 0, hasher=None, buffer_size: int = WRITE_BUFFER_SIZE):
+        self.path = path
+        self.size = size  # 已知的文件大小，用于预分配磁盘空间
+        self.buffer_size = buffer_size
+        self.written = 0
+        self.write_seconds = 0.0  # 写入线程中实际花费的时间（含哈希计算）
+        self.hasher = hasher  # 可选的hashlib对象，在写入线程中随写入更新
+        self._file = None
+        self._buffer = []
+        self._buffered = 0
+        self._pending: Optional[asyncio.Future] = None
+    
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self._file = await loop.run_in_executor(_io_executor, self._open_file)
+        return self
+    
+    def _open_file(self):
+        f = open(self.path, 'wb')
+        if self.size > 0:
+            self._preallocate(f)
+        return f
+    
+    def _preallocate(self, f):
+        """预先分配磁盘空间，减少写入过程中的文件碎片和元数据更新"""
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, self.size)
+            else:
+                f.truncate(self.size)
+        except OSError as e:
+            logger.warning(f"预分配文件空间失败: {str(e)}")
+    
+    async def write(self, chunk: bytes):
+        self._buffer.append(chunk)
+        self._buffered += len(chunk)
+        if self._buffered >= self.buffer_size:
+            await self._flush_buffer()
+    
+    async def _flush_buffer(self):
+        if self._pending is not None:
+            await self._pending
+            self._pending = None
+        if not self._buffer:
+            return
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        loop = asyncio.get_running_loop()
+        self._pending = loop.run_in_executor(_io_executor, self._write_data, data)
+    
+    def _write_data(self, data: bytes):
+        started = time.monotonic()
+        self._file.write(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+        self.written += len(data)
+        self.write_seconds += time.monotonic() - started
+    
+    async def close(self):
+        """写入剩余数据并关闭文件；实际写入量小于预分配大小时截断多余的空间"""
+        await self._flush_buffer()
+        if self._pending is not None:
+            await self._pending
+            self._pending = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_io_executor, self._close_file)
+        metrics.observe("disk_write_seconds", self.write_seconds)
+        metrics.inc("disk_write_bytes_total", self.written)
+    
+    def _close_file(self):
+        if self._file is None:
+            return
+        try:
+            if self.size > 0 and self.written != self.size:
+                self._file.truncate(self.written)
+        finally:
+            self._file.close()
+            self._file = None
+    
+    async def abort(self):
+        """放弃写入：等待进行中的写入结束后关闭文件，由调用方删除文件"""
+        self._buffer = []
+        self._buffered = 0
+        pending = self._pending
+        self._pending = None
+        if pending is not None:
+            await asyncio.gather(pending, return_exceptions=True)
+        if self._file is not None:
+            file = self._file
+            self._file = None
+            await asyncio.get_running_loop().run_in_executor(_io_executor, file.close)
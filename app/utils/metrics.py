@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 耗时直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 图片大小直方图的分桶（字节）
+SIZE_BUCKETS = tuple(2 ** power * 1024 for power in range(4, 17, 2))  # 16 KiB ~ 64 MiB
+
+# 当前所在的span，子span据此记录父span和trace_id；asyncio任务创建时（包括run_coroutine_threadsafe提交时）会复制当前上下文
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Histogram:
+    """固定分桶的直方图，分位数在所在的桶内线性插值估算"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # 最后一个桶为 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+    
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+    
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            if bucket_count and cumulative + bucket_count >= target:
+                # 在桶内按线性分布插值，桶的边界用实际的最小值和最大值收紧
+                lower = max(self.buckets[index - 1] if index > 0 else self.min, self.min)
+                upper = min(self.buckets[index] if index < len(self.buckets) else self.max, self.max)
+                return lower + (upper - lower) * (target - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.max
+    
+    def cumulative_counts(self):
+        """返回 (上界, 累计数量) 列表，与Prometheus的 _bucket 指标一致"""
+        result = []
+        cumulative = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            cumulative += bucket_count
+            upper = self.buckets[index] if index < len(self.buckets) else float('inf')
+            result.append((upper, cumulative))
+        return result
+    
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": {_format_bound(upper): count for upper, count in self.cumulative_counts()}
+        }
+
+class Span:
+    """一段计时的操作，结束时记录到 <name>_seconds 直方图；可在结束前修改labels和status"""
+    def __init__(self, name: str, labels: dict, parent: Optional['Span'] = None):
+        self.name = name
+        self.labels = labels
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.parent = parent.name if parent else None
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.status = "ok"
+    
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "labels": dict(self.labels),
+            "trace_id": self.trace_id,
+            "parent": self.parent,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "status": self.status
+        }
+
+class MetricsRegistry:
+    """进程内的性能指标：计数器、直方图和最近的span，可导出JSON快照或Prometheus文本格式
+    
+    指标按名称和标签区分，标签值只应使用API名称、主机、状态等取值有限的字符串，不要使用URL
+    """
+    def __init__(self, namespace: str = "setu", span_history: int = 200):
+        self.namespace = namespace
+        self.counters = {}  # (名称, 标签) -> 数值
+        self.histograms = {}  # (名称, 标签) -> Histogram
+        self.recent_spans = deque(maxlen=span_history)
+        self.lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+    
+    @staticmethod
+    def _labels_key(labels: dict) -> tuple:
+        return tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+    
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, self._labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name: str, value: float, buckets=None, **labels):
+        key = (name, self._labels_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets or DEFAULT_BUCKETS)
+            histogram.observe(value)
+    
+    @contextmanager
+    def span(self, name: str, **labels):
+        """计时上下文管理器，同步和异步代码中都可以使用：with metrics.span("resolve", api=name) as span: ..."""
+        parent = _current_span.get()
+        span = Span(name, labels, parent)
+        token = _current_span.set(span)
+        started = time.monotonic()
+        try:
+            yield span
+        except asyncio.CancelledError:
+            span.status = "cancelled"
+            raise
+        except BaseException:
+            span.status = "error"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.duration = time.monotonic() - started
+            self.observe(f"{name}_seconds", span.duration, status=span.status, **span.labels)
+            with self.lock:
+                self.recent_spans.append(span)
+    
+    def snapshot(self) -> dict:
+        with self.lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({"labels": dict(labels), "value": value})
+            histograms = {}
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                histograms.setdefault(name, []).append({"labels": dict(labels), **histogram.to_dict()})
+            spans = [span.to_dict() for span in self.recent_spans]
+        return {
+            "timestamp": time.time(),
+            "counters": counters,
+            "histograms": histograms,
+            "recent_spans": spans
+        }
+    
+    def to_prometheus(self) -> str:
+        """导出Prometheus文本格式（0.0.4）"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(((key, histogram.cumulative_counts(), histogram.sum, histogram.count)
+                                 for key, histogram in self.histograms.items()), key=lambda item: item[0])
+        
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f"{self.namespace}_{name}"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), buckets, total, count in histograms:
+            metric = f"{self.namespace}_{name}"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            for upper, cumulative in buckets:
+                lines.append(f"{metric}_bucket{_format_labels(labels + (('le', _format_bound(upper)),))} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+    
+    def write_json(self, path: str):
+        self._write_atomic(path, json.dumps(self.snapshot(), ensure_ascii=False, indent=2))
+    
+    def write_prometheus(self, path: str):
+        self._write_atomic(path, self.to_prometheus())
+    
+    def write_file(self, path: str):
+        """按扩展名导出：.json 为JSON快照，其余为Prometheus文本格式（可供node_exporter的textfile收集器读取）"""
+        if path.lower().endswith('.json'):
+            self.write_json(path)
+        else:
+            self.write_prometheus(path)
+    
+    @staticmethod
+    def _write_atomic(path: str, content: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    
+    def start_http_server(self, port: int, host: str = "127.0.0.1") -> bool:
+        """在后台线程中提供 /metrics（Prometheus文本格式）和 /metrics.json（JSON快照）"""
+        if self._server is not None:
+            return True
+        registry = self
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/metrics':
+                    body = registry.to_prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif path == '/metrics.json':
+                    body = json.dumps(registry.snapshot(), ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json; charset=utf-8'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        try:
+            self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            logger.error(f"启动指标服务失败: {str(e)}")
+            return False
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        logger.info(f"指标服务已启动: http://{host}:{self._server.server_address[1]}/metrics")
+        return True
+    
+    def stop_http_server(self):
+        server = self._server
+        self._server = None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.recent_spans.clear()
+
+def _format_bound(upper: float) -> str:
+    return "+Inf" if upper == float('inf') else _format_value(upper)
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in labels:
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+# 导出默认指标实例
+metrics = MetricsRegistry()
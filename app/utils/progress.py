@@ -0,0 +1,119 @@
+import time
+import threading
+from typing import Optional
+
+from app.models.download import ProgressInfo
+
+class ProgressAggregator:
+    """合并高频的字节进度更新：只在整数百分比变化且距上次回调超过min_interval时回调，结束时保证回调一次
+    
+    下载层每收到一块数据就调用update(已下载字节数, 总字节数)，回调频率与块大小和传输速度无关，
+    回调参数为ProgressInfo（含百分比、速度和剩余时间），不依赖界面，命令行模式同样可以使用
+    """
+    def __init__(self, callback, min_interval: float = 0.1, speed_smoothing: float = 0.3):
+        self.callback = callback
+        self.min_interval = min_interval
+        self.speed_smoothing = speed_smoothing  # 速度的指数平滑系数，越大越接近瞬时速度
+        self.lock = threading.Lock()
+        self._reset(time.monotonic())
+    
+    def _reset(self, now: float):
+        self.started = now
+        self.downloaded = 0
+        self.total = 0
+        self.speed = 0.0
+        self._last_percent = -1
+        self._last_report = 0.0
+        self._sample_time = now
+        self._sample_bytes = 0
+        self._partial = False  # 是否收到过未完成时的进度；一次就报告完整大小的（如暂存或复用的图片）没有实际传输
+    
+    def update(self, downloaded: int, total: int = 0):
+        """记录当前进度；已下载字节数变小时视为开始了新的传输（如换用其他API重新下载）"""
+        now = time.monotonic()
+        with self.lock:
+            if downloaded < self.downloaded:
+                self._reset(now)
+            self.downloaded = downloaded
+            self.total = total
+            if total <= 0 or downloaded < total:
+                self._partial = True
+            self._update_speed(now)
+            
+            percent = self._percent()
+            # 总大小未知时没有百分比，只按时间间隔回调
+            percent_changed = percent != self._last_percent or total <= 0
+            if not percent_changed or now - self._last_report < self.min_interval:
+                return
+            info = self._snapshot(now, percent, finished=False)
+        self._emit(info)
+    
+    def finish(self):
+        """传输结束时回调最终进度（100%）"""
+        now = time.monotonic()
+        with self.lock:
+            if self.total <= 0 or self.downloaded > self.total:
+                self.total = self.downloaded
+            self.downloaded = self.total
+            # 传输太快还没有速度样本时按整体耗时计算；没有实际传输时速度保持为0
+            if self.speed <= 0 and self._partial and now > self.started:
+                self.speed = self.downloaded / (now - self.started)
+            info = self._snapshot(now, 100, finished=True)
+        self._emit(info)
+        return info
+    
+    def _update_speed(self, now: float):
+        elapsed = now - self._sample_time
+        # 间隔太短时速度抖动大，攒够一段时间再计算
+        if elapsed < 0.2:
+            return
+        instant_speed = (self.downloaded - self._sample_bytes) / elapsed
+        if self.speed <= 0:
+            self.speed = instant_speed
+        else:
+            self.speed += self.speed_smoothing * (instant_speed - self.speed)
+        self._sample_time = now
+        self._sample_bytes = self.downloaded
+    
+    def _percent(self) -> int:
+        if self.total <= 0:
+            return 0
+        return min(100, int(self.downloaded * 100 / self.total))
+    
+    def _snapshot(self, now: float, percent: int, finished: bool) -> ProgressInfo:
+        self._last_percent = percent
+        self._last_report = now
+        eta = None
+        if finished:
+            eta = 0.0
+        elif self.total > 0 and self.speed > 0:
+            eta = (self.total - self.downloaded) / self.speed
+        return ProgressInfo(
+            downloaded=self.downloaded,
+            total=self.total,
+            percent=percent,
+            speed=self.speed,
+            eta=eta,
+            elapsed=now - self.started,
+            finished=finished
+        )
+    
+    def _emit(self, info: ProgressInfo):
+        if self.callback:
+            self.callback(info)
+
+def format_size(size: float) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def format_speed(speed: float) -> str:
+    return f"{format_size(speed)}/s"
+
+def format_eta(eta: Optional[float]) -> str:
+    if eta is None:
+        return "--:--"
+    eta = int(eta)
+    return f"{eta // 60:02d}:{eta % 60:02d}"
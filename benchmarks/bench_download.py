@@ -0,0 +1,240 @@
+"""下载服务性能测试（使用本地模拟API服务器）
+
+测量每种API响应方式的点击延迟、预加载池填充时间、使用预加载时的点击延迟、批量下载吞吐量和内存占用，
+以及性能指标中各阶段的耗时分布；结果为JSON，便于比较不同版本
+
+用法: python -m benchmarks.bench_download [--clicks 30] [--batch 200] [--concurrency 8]
+      [--latency 0.02] [--jitter 0.01] [--error-rate 0] [--image-size 65536] [--output result.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+from benchmarks.mock_server import MockApiServer, STYLES
+from app.network.http_client import http_client
+from app.services.api_service import api_service
+from app.utils.metrics import metrics
+# 下载服务在导入时就会在当前目录下创建并扫描Download目录，由run()在临时目录中导入
+
+PRELOAD_FILL_TIMEOUT = 30  # 预加载池填充测试中等待池满的最长秒数
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def summarize(timings) -> dict:
+    timings = sorted(timings)
+    if not timings:
+        return {"count": 0}
+    return {
+        "count": len(timings),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+        "p50_ms": round(percentile(timings, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+        "max_ms": round(timings[-1] * 1000, 3)
+    }
+
+def load_apis(server: MockApiServer, styles, api_file: str):
+    """把模拟服务器的API写入本地API文件，并按本地来源加载"""
+    from app.services.download_service import download_service
+    with open(api_file, "w", encoding="utf-8") as f:
+        for style in styles:
+            f.write(f"{style}:{server.api_url(style)}\n")
+    api_service.api_file = api_file
+    download_service.reset_prefetch()
+    return api_service.load_apis("local")
+
+def measure_clicks(clicks: int, think_time: float, preload: bool) -> dict:
+    """连续点击下载，preload为False时关闭预加载，每次点击都从API获取"""
+    from app.services.download_service import download_service
+    preload_size = download_service.preload_size
+    if not preload:
+        download_service.preload_size = 0
+        download_service.reset_prefetch()
+    timings = []
+    failures = 0
+    try:
+        for _ in range(clicks):
+            started = time.perf_counter()
+            save_path, _ = download_service.download()
+            timings.append(time.perf_counter() - started)
+            if not save_path:
+                failures += 1
+            if think_time > 0:
+                time.sleep(think_time)
+    finally:
+        download_service.preload_size = preload_size
+    return {**summarize(timings), "failures": failures}
+
+def measure_preload_fill(rounds: int) -> dict:
+    """从空的预加载池开始，由后台预加载调度任务补充到容量所需的时间"""
+    from app.services.download_service import download_service
+    timings = []
+    filled = []
+    for _ in range(rounds):
+        download_service.reset_prefetch()
+        started = time.perf_counter()
+        download_service.start_prefetch()
+        while True:
+            with download_service.lock:
+                size = len(download_service.preload_pool)
+            elapsed = time.perf_counter() - started
+            if size >= download_service.preload_size or elapsed > PRELOAD_FILL_TIMEOUT:
+                break
+            time.sleep(0.001)
+        timings.append(elapsed)
+        filled.append(size)
+    return {**summarize(timings), "pool_size": download_service.preload_size, "min_filled": min(filled, default=0)}
+
+def measure_throughput(count: int, concurrency: int) -> dict:
+    from app.services.download_service import download_service
+    started = time.perf_counter()
+    tasks = download_service.download_batch(count, concurrency=concurrency)
+    elapsed = time.perf_counter() - started
+    saved = [task.save_path for task in tasks if task.save_path]
+    total_bytes = sum(os.path.getsize(path) for path in saved if os.path.exists(path))
+    return {
+        "count": count,
+        "concurrency": concurrency,
+        "succeeded": len(saved),
+        "seconds": round(elapsed, 3),
+        "images_per_second": round(len(saved) / elapsed, 2) if elapsed > 0 else 0.0,
+        "mb_per_second": round(total_bytes / elapsed / 1024 / 1024, 2) if elapsed > 0 else 0.0
+    }
+
+def measure_memory(count: int, concurrency: int) -> dict:
+    """在tracemalloc下执行一次较小的批量下载，记录Python对象的峰值内存；tracemalloc会拖慢运行，不与吞吐量一起测量"""
+    from app.services.download_service import download_service
+    tracemalloc.start()
+    try:
+        download_service.download_batch(count, concurrency=concurrency)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result = {
+        "batch": count,
+        "traced_current_mb": round(current / 1024 / 1024, 2),
+        "traced_peak_mb": round(peak / 1024 / 1024, 2)
+    }
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux下单位为KB，macOS下为字节
+        result["max_rss_mb"] = round(max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 2)
+    except ImportError:
+        pass
+    return result
+
+def stage_summary() -> dict:
+    """性能指标中各阶段（*_seconds）的耗时分布"""
+    summary = {}
+    for name, series in metrics.snapshot()["histograms"].items():
+        if not name.endswith("_seconds"):
+            continue
+        summary[name] = [{
+            "labels": item["labels"],
+            "count": item["count"],
+            "p50_ms": round(item["p50"] * 1000, 3) if item["p50"] is not None else None,
+            "p99_ms": round(item["p99"] * 1000, 3) if item["p99"] is not None else None
+        } for item in series]
+    return summary
+
+def run(args) -> dict:
+    random.seed(args.seed)
+    styles = args.styles.split(",") if args.styles else list(STYLES)
+    server = MockApiServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                           image_size=args.image_size, seed=args.seed)
+    server.start()
+    # 模拟服务器只有一个主机，默认不按主机限速，测量下载流程本身
+    requests_per_second = http_client.rate_limiter.requests_per_second
+    http_client.rate_limiter.set_requests_per_host(args.requests_per_host)
+    results = {
+        "config": {
+            "styles": styles,
+            "clicks": args.clicks,
+            "batch": args.batch,
+            "concurrency": args.concurrency,
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "image_size": args.image_size,
+            "requests_per_host": args.requests_per_host,
+            "seed": args.seed
+        }
+    }
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # 在临时目录中导入下载服务，导入时创建和扫描的默认下载目录不会落在运行目录下
+            os.chdir(temp_dir)
+            from app.services.download_service import download_service
+            download_service.set_download_dir(os.path.join(temp_dir, "Download"))
+            api_file = os.path.join(temp_dir, "apis.txt")
+            metrics.reset()
+            
+            # 每种响应方式单独测量不使用预加载时的点击延迟
+            results["cold_clicks"] = {}
+            for style in styles:
+                load_apis(server, [style], api_file)
+                results["cold_clicks"][style] = measure_clicks(args.clicks, 0, preload=False)
+            
+            load_apis(server, styles, api_file)
+            results["preload_fill"] = measure_preload_fill(args.fill_rounds)
+            # 点击间隔足够预加载补充时，点击直接使用暂存的图片
+            results["preloaded_clicks"] = measure_clicks(args.clicks, args.think_time, preload=True)
+            download_service.reset_prefetch()
+            results["throughput"] = measure_throughput(args.batch, args.concurrency)
+            results["memory"] = measure_memory(args.memory_batch, args.concurrency)
+            results["stages"] = stage_summary()
+            results["server"] = dict(server.stats)
+            
+            download_service.reset_prefetch()
+            # 删除临时目录前先切换回原目录
+            os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        http_client.rate_limiter.set_requests_per_host(requests_per_second)
+        http_client.run(http_client.async_close())
+        server.stop()
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="下载服务性能测试（本地模拟API服务器）")
+    parser.add_argument("--styles", default=None, help=f"逗号分隔的API响应方式，默认全部: {','.join(STYLES)}")
+    parser.add_argument("--clicks", type=int, default=30, help="每项点击测试的点击次数")
+    parser.add_argument("--think-time", type=float, default=0.2, help="使用预加载时两次点击之间的间隔（秒）")
+    parser.add_argument("--fill-rounds", type=int, default=5, help="预加载池填充测试的次数")
+    parser.add_argument("--batch", type=int, default=200, help="吞吐量测试的下载数量")
+    parser.add_argument("--memory-batch", type=int, default=50, help="内存测试的下载数量")
+    parser.add_argument("--concurrency", type=int, default=8, help="批量下载的并发数")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟服务器每个请求的延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.01, help="在延迟上增加的随机延迟上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="API请求返回503的概率")
+    parser.add_argument("--image-size", type=int, default=64 * 1024, help="图片大小（字节）")
+    parser.add_argument("--requests-per-host", type=float, default=0, help="按主机限速（每秒请求数），默认0不限制")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    parser.add_argument("--output", default=None, help="结果JSON文件路径，默认输出到标准输出")
+    args = parser.parse_args(argv)
+    
+    unknown = [style for style in (args.styles or "").split(",") if style and style not in STYLES]
+    if unknown:
+        parser.error(f"未知的响应方式: {','.join(unknown)}")
+    
+    results = run(args)
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
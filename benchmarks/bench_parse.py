@@ -0,0 +1,93 @@
+"""apis.txt解析性能测试
+
+用法: python -m benchmarks.bench_parse [--lines 100000] [--repeat 5] [--output result.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+from app.services.api_parser import ApiParser
+
+def generate_api_list(line_count: int, seed: int = 0) -> str:
+    """生成包含注释、空行、参数标记、说明和权重的API列表"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(line_count):
+        kind = rng.random()
+        if kind < 0.05:
+            lines.append(f"# 注释 {i}")
+        elif kind < 0.08:
+            lines.append("")
+        else:
+            prefix = "!" if rng.random() < 0.3 else ""
+            name = f"api{i}:" if rng.random() < 0.7 else ""
+            description = f"{{说明{i}}}" if rng.random() < 0.5 else ""
+            comment = f"#备注{i}" if rng.random() < 0.2 else ""
+            lines.append(f"{prefix}{name}https://example{i % 97}.com/api/{i}?type=json|{rng.randint(0, 50)}|{description}{comment}")
+    return "\n".join(lines)
+
+def measure(func, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "min_ms": round(timings[0] * 1000, 3),
+        "median_ms": round(timings[len(timings) // 2] * 1000, 3),
+        "max_ms": round(timings[-1] * 1000, 3)
+    }
+
+def run(line_count: int, repeat: int) -> dict:
+    content = generate_api_list(line_count)
+    lines = content.split("\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "apis.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        
+        warm_parser = ApiParser()
+        warm_parser.parse(content, "local")
+        warm_parser.parse_file(path, "local")
+        
+        results = {
+            "lines": line_count,
+            "apis": len(ApiParser().parse_lines(lines, "local")),
+            "repeat": repeat,
+            # 不使用缓存的单遍解析
+            "parse_lines": measure(lambda: ApiParser().parse_lines(lines, "local"), repeat),
+            # 首次解析文本（包含计算内容哈希）
+            "parse_cold": measure(lambda: ApiParser().parse(content, "local"), repeat),
+            # 内容未变化时命中缓存（只计算哈希并复制结果）
+            "parse_cached": measure(lambda: warm_parser.parse(content, "local"), repeat),
+            # 首次逐行读取并解析文件
+            "parse_file_cold": measure(lambda: ApiParser().parse_file(path, "local"), repeat),
+            # 文件mtime/大小未变化时命中缓存
+            "parse_file_cached": measure(lambda: warm_parser.parse_file(path, "local"), repeat)
+        }
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="apis.txt解析性能测试")
+    parser.add_argument("--lines", type=int, default=100000, help="API列表行数")
+    parser.add_argument("--repeat", type=int, default=5, help="每项测试的重复次数")
+    parser.add_argument("--output", default=None, help="结果JSON文件路径，默认输出到标准输出")
+    args = parser.parse_args(argv)
+    
+    results = run(args.lines, args.repeat)
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
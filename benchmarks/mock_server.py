@@ -0,0 +1,131 @@
+"""性能测试用的本地API和图片服务器
+
+按下载服务能处理的几种响应方式提供API，延迟、错误率和图片大小都可以配置：
+- /api/image          直接返回图片
+- /api/json_data      {"data": "图片URL"}
+- /api/json_url       {"url": "图片URL"}
+- /api/json_original  {"data": [{"urls": {"original": "图片URL"}}]}
+- /api/html           包含 <img src="..."> 的网页
+- /api/redirect       302重定向到图片URL
+- /img/{name}         图片内容
+
+每张图片的内容都不同，避免被下载服务按内容去重
+"""
+import os
+import asyncio
+import random
+import threading
+from typing import Optional
+
+from aiohttp import web
+
+STYLES = ("image", "json_data", "json_url", "json_original", "html", "redirect")
+
+class MockApiServer:
+    """在独立线程的事件循环中运行的aiohttp服务器，与被测的下载服务互不共享事件循环"""
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 image_size: int = 64 * 1024, host: str = "127.0.0.1", port: int = 0, seed: int = 0):
+        self.latency = latency  # 每个请求的基础延迟（秒）
+        self.jitter = jitter  # 在基础延迟上增加 [0, jitter] 的随机延迟
+        self.error_rate = error_rate  # API请求返回503的概率（图片请求不出错）
+        self.image_size = image_size
+        self.host = host
+        self.port = port
+        self.rng = random.Random(seed)
+        self.stats = {"api_requests": 0, "image_requests": 0, "errors": 0, "bytes_sent": 0}
+        self._counter = 0
+        # 图片内容的公共部分只生成一次，每张图片只在开头写入不同的序号
+        self._payload = os.urandom(image_size)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+    
+    def api_url(self, style: str) -> str:
+        return f"{self.base_url}/api/{style}"
+    
+    def _next_image_url(self) -> str:
+        with self._lock:
+            self._counter += 1
+            return f"{self.base_url}/img/{self._counter}.jpg"
+    
+    async def _delay(self):
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    async def _handle_api(self, request: web.Request) -> web.StreamResponse:
+        style = request.match_info["style"]
+        self.stats["api_requests"] += 1
+        await self._delay()
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.Response(status=503, text="service unavailable")
+        
+        if style == "image":
+            return self._image_response(self._next_image_url())
+        image_url = self._next_image_url()
+        if style == "json_data":
+            return web.json_response({"code": 200, "data": image_url})
+        if style == "json_url":
+            return web.json_response({"code": 200, "url": image_url})
+        if style == "json_original":
+            return web.json_response({"code": 200, "data": [{"pid": self._counter, "urls": {"original": image_url}}]})
+        if style == "html":
+            return web.Response(text=f'<html><body><img src="{image_url}" alt="setu"></body></html>', content_type="text/html")
+        if style == "redirect":
+            raise web.HTTPFound(image_url)
+        return web.Response(status=404, text=f"unknown style: {style}")
+    
+    async def _handle_image(self, request: web.Request) -> web.StreamResponse:
+        await self._delay()
+        return self._image_response(request.match_info["name"])
+    
+    def _image_response(self, name: str) -> web.Response:
+        self.stats["image_requests"] += 1
+        self.stats["bytes_sent"] += self.image_size
+        tag = name.encode("utf-8")[:64]
+        body = tag + self._payload[len(tag):]
+        return web.Response(body=body, content_type="image/jpeg")
+    
+    async def _start_async(self):
+        app = web.Application()
+        app.add_routes([
+            web.get("/api/{style}", self._handle_api),
+            web.get("/img/{name}", self._handle_image),
+        ])
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # 端口为0时由系统分配
+        self.port = self._runner.addresses[0][1]
+    
+    def start(self) -> str:
+        """启动服务器并返回根地址"""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start_async())
+            started.set()
+            self._loop.run_forever()
+        
+        self._thread = threading.Thread(target=run, name="mock-api-server", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.base_url
+    
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
@@ -0,0 +1,104 @@
+import sys
+import argparse
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="随机Setu下载器（无界面批量下载）")
+    parser.add_argument("-n", "--count", type=int, default=10, help="下载图片数量")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="并发下载数")
+    parser.add_argument("-s", "--source", choices=["recommended", "local"], default=None,
+                        help="API来源，默认使用配置文件中的设置")
+    parser.add_argument("-o", "--output", default=None, help="下载目录，默认为Download")
+    parser.add_argument("--limit-rate", type=int, default=0, metavar="KB/S",
+                        help="图片下载的总带宽上限（KB/s），默认不限制")
+    parser.add_argument("--requests-per-host", type=float, default=None, metavar="N",
+                        help="每个主机每秒的请求数上限（包括图片下载），0为不限制，默认使用配置文件中的设置")
+    parser.add_argument("-d", "--duplicates", choices=["skip", "hardlink", "keep"], default=None,
+                        help="重复图片的处理方式，默认使用配置文件中的设置")
+    parser.add_argument("--metrics-file", default=None, metavar="PATH",
+                        help="下载结束后导出性能指标，.json 为JSON快照，其他扩展名为Prometheus文本格式")
+    parser.add_argument("--metrics-port", type=int, default=0, metavar="PORT",
+                        help="下载期间在 127.0.0.1:PORT/metrics 提供Prometheus格式的性能指标")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    
+    from app.services.api_service import api_service
+    from app.services.config_service import config_service
+    from app.services.download_service import download_service
+    from app.network.http_client import http_client
+    from app.utils.progress import format_speed
+    from app.utils.metrics import metrics
+    
+    if args.output:
+        download_service.set_download_dir(args.output)
+    if args.duplicates:
+        download_service.duplicate_mode = args.duplicates
+    if args.limit_rate > 0:
+        http_client.rate_limiter.set_bandwidth_limit(args.limit_rate * 1024)
+    requests_per_host = args.requests_per_host if args.requests_per_host is not None else config_service.get_requests_per_host()
+    http_client.rate_limiter.set_requests_per_host(requests_per_host)
+    if args.metrics_port > 0:
+        metrics.start_http_server(args.metrics_port)
+    
+    source = args.source or config_service.get_api_source()
+    
+    def apply_saved_configs(apis):
+        # 保存的启用状态和参数按来源区分，只有来源一致时才应用
+        if source == config_service.get_api_source():
+            config_service.load_api_configs(apis)
+        return api_service.recalculate_weights()
+    
+    # API列表在后台重新验证或本地文件热重载后可能被替换，需要重新应用保存的配置
+    api_service.add_change_listener(lambda changed_source, diff=None: apply_saved_configs(api_service.get_apis()))
+    apis = api_service.load_apis(source)
+    apply_saved_configs(apis)
+    
+    enabled_count = sum(1 for api in api_service.get_apis() if api.enabled)
+    if enabled_count == 0:
+        print("没有可用的API", file=sys.stderr)
+        return 1
+    print(f"已加载 {len(apis)} 个API，启用 {enabled_count} 个")
+    
+    def on_progress(completed, total, task):
+        if task.save_path:
+            print(f"[{completed}/{total}] 成功: {task.save_path} (来自 {task.api_name}，{format_speed(task.speed)})")
+        else:
+            print(f"[{completed}/{total}] 失败: {task.error_message}")
+    
+    tasks = download_service.download_batch(args.count, concurrency=args.concurrency, progress_callback=on_progress)
+    success_count = sum(1 for task in tasks if task.save_path)
+    print(f"下载完成: 成功 {success_count}/{args.count}")
+    if args.metrics_file:
+        try:
+            metrics.write_file(args.metrics_file)
+            print(f"性能指标已导出: {args.metrics_file}")
+        except OSError as e:
+            print(f"导出性能指标失败: {str(e)}", file=sys.stderr)
+    return 0 if success_count > 0 else 1
+
+if __name__ == "__main__":
+    exit_code = 1
+    try:
+        logger.info("命令行模式启动")
+        exit_code = main()
+    except KeyboardInterrupt:
+        logger.info("用户中断下载")
+    except Exception as e:
+        logger.error(f"命令行模式运行失败: {str(e)}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        # 关闭HTTP客户端会话，释放资源
+        try:
+            from app.network.http_client import http_client
+            http_client.close()
+            logger.info("HTTP客户端会话已关闭")
+        except Exception as e:
+            logger.error(f"关闭HTTP客户端会话失败: {str(e)}")
+    
+    sys.exit(exit_code)